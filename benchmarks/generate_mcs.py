@@ -0,0 +1,210 @@
+"""Synthetic MCS Multiwell exports for benchmarking.
+
+Writes <plate>_spikes.csv, <plate>_bursts.csv, <plate>_net_bursts.csv and
+conditions.txt with the columns of the MCS exports. Spikes are Poisson
+background activity plus network bursts, in which most electrodes of a well
+fire a short train of spikes, so burst detection and all metrics have
+realistic work to do. The bursts exports are detected in the generated
+spikes (core.mea_burst_detection).
+
+    python -m benchmarks.generate_mcs <out dir> --wells 24 --channels 12 \\
+        --rate 5 --duration 300
+"""
+import argparse
+import os
+import string
+from dataclasses import asdict, dataclass
+
+import numpy as np
+import pandas as pd
+
+from core.mea_burst_detection import detect_all
+from core.mea_spike_trains import TIMESTAMP_COL
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Rows x columns of the common plate formats
+PLATE_LAYOUTS = {6: (2, 3), 12: (3, 4), 24: (4, 6), 48: (6, 8),
+                 72: (6, 12), 96: (8, 12)}
+
+# Constant columns of the exports, not used by the analysis
+COMPOUND_COLUMNS = {'Compound ID': 'bench', 'Compound Name': 'none',
+                    'Experiment': 'benchmark', 'Dose Label': 'Control',
+                    'Dose [pM]': 0}
+
+
+@dataclass
+class plate_spec:
+    wells: int = 24
+    channels: int = 12
+    # Mean firing rate of every electrode, bursts included
+    rate_hz: float = 5.
+    duration_s: float = 300.
+    # Share of the spikes that fire in network bursts
+    burst_fraction: float = 0.3
+    spikes_per_burst: int = 15
+    seed: int = 0
+
+    @property
+    def label(self):
+        return (f'w{self.wells}_c{self.channels}_r{self.rate_hz:g}'
+                f'_d{self.duration_s:g}')
+
+
+def well_labels(wells):
+    """Well labels (A1, A2, ...) in the layout of a plate with this many."""
+    rows, cols = PLATE_LAYOUTS.get(
+            wells, (int(np.ceil(wells / 12)), min(wells, 12)))
+    return [f'{string.ascii_uppercase[i // cols]}{i % cols + 1}'
+            for i in range(wells)]
+
+
+def channel_labels(channels):
+    """Electrode labels like MCS' (11, 12, ..., 21, ...), a square grid."""
+    side = int(np.ceil(np.sqrt(channels)))
+    return [(i // side + 1) * 10 + i % side + 1 for i in range(channels)]
+
+
+def generate_spikes(spec: plate_spec):
+    """Well index, channel index and time stamp [µs] of every spike."""
+    rng = np.random.default_rng(spec.seed)
+    duration_us = int(spec.duration_s * 1e6)
+    electrodes = spec.wells * spec.channels
+
+    # Poisson background, all electrodes at once
+    background = rng.poisson(spec.rate_hz * spec.duration_s
+                             * (1 - spec.burst_fraction), electrodes)
+    electrode = np.repeat(np.arange(electrodes), background)
+    times = rng.integers(0, duration_us, len(electrode))
+
+    # Network bursts: most electrodes of a well fire a train of spikes with
+    # short intervals at about the same time
+    participation = 0.8
+    burst_count = rng.poisson(spec.rate_hz * spec.duration_s
+                              * spec.burst_fraction
+                              / (spec.spikes_per_burst * participation),
+                              spec.wells)
+    burst_well = np.repeat(np.arange(spec.wells), burst_count)
+    burst_start = rng.integers(0, duration_us, len(burst_well))
+    # One burst per participating electrode of the well
+    member = rng.random((len(burst_well), spec.channels)) < participation
+    burst, channel = np.nonzero(member)
+    burst_electrode = burst_well[burst] * spec.channels + channel
+    jitter = rng.integers(0, 20_000, len(burst))
+    length = 1 + rng.poisson(spec.spikes_per_burst - 1, len(burst))
+    spike_burst = np.repeat(np.arange(len(burst)), length)
+    isi = rng.exponential(5_000, len(spike_burst)).astype(np.int64) + 500
+    # Cumulative intervals within every burst
+    offset = np.cumsum(isi)
+    first = np.cumsum(length) - length
+    offset -= np.repeat(offset[first] - isi[first], length)
+    burst_times = (burst_start[burst] + jitter)[spike_burst] + offset
+
+    electrode = np.r_[electrode, burst_electrode[spike_burst]]
+    times = np.r_[times, burst_times]
+    keep = times < duration_us
+    electrode, times = electrode[keep], times[keep]
+    # Exports are sorted by well, channel and time
+    order = np.lexsort((times, electrode))
+    electrode, times = electrode[order], times[order]
+    return electrode // spec.channels, electrode % spec.channels, times
+
+
+def _export_columns(well, channel, spec, wells, channels):
+    columns = {'Well ID': well, 'Well Label': wells[well]}
+    if channel is not None:
+        columns['Channel ID'] = well * spec.channels + channel
+        columns['Channel Label'] = channels[channel]
+    columns.update({k: np.full(len(well), v)
+                    for k, v in COMPOUND_COLUMNS.items()})
+    return columns
+
+
+def _write_csv(columns, filename):
+    if HAS_PYARROW:
+        table = pa.table({k: pa.array(v) for k, v in columns.items()})
+        pa_csv.write_csv(table, filename,
+                         pa_csv.WriteOptions(quoting_style='needed'))
+    else:
+        pd.DataFrame(columns).to_csv(filename, index=False)
+
+
+def write_plate(out_dir, spec: plate_spec, plate_name='bench'):
+    """Write the exports of a synthetic plate, returns the spike count."""
+    os.makedirs(out_dir, exist_ok=True)
+    wells = np.array(well_labels(spec.wells))
+    channels = np.array(channel_labels(spec.channels))
+    rng = np.random.default_rng(spec.seed + 1)
+
+    well, channel, times = generate_spikes(spec)
+    spikes = _export_columns(well, channel, spec, wells, channels)
+    spikes[TIMESTAMP_COL] = times
+    spikes['Maximum Amplitude [pV]'] = np.round(
+            rng.normal(-3e7, 1e7, len(times)))
+    _write_csv(spikes, os.path.join(out_dir, f'{plate_name}_spikes.csv'))
+
+    # The exported bursts are the detected ones of the generated spikes
+    bursts, net_bursts = detect_all(pd.DataFrame({
+            'Well Label': pd.Categorical.from_codes(well, wells),
+            'Channel Label': pd.Categorical.from_codes(channel, channels),
+            TIMESTAMP_COL: times}))
+    # Their labels keep the categories of the spikes, i.e. wells/channels
+    columns = _export_columns(bursts['Well Label'].cat.codes.to_numpy(),
+                              bursts['Channel Label'].cat.codes.to_numpy(),
+                              spec, wells, channels)
+    for col in ['Start timestamp [µs]', 'Duration [µs]', 'Spike Count',
+                'Spike Frequency [Hz]']:
+        columns[col] = bursts[col].to_numpy()
+    _write_csv(columns, os.path.join(out_dir, f'{plate_name}_bursts.csv'))
+
+    columns = _export_columns(net_bursts['Well Label'].cat.codes.to_numpy(),
+                              None, spec, wells, channels)
+    for col in ['Start timestamp [µs]', 'Duration [µs]', 'Spike Count',
+                'Spike Frequency [Hz]']:
+        columns[col] = net_bursts[col].to_numpy()
+    _write_csv(columns, os.path.join(out_dir,
+                                     f'{plate_name}_net_bursts.csv'))
+
+    # Two conditions, half of the wells each
+    half = len(wells) // 2
+    conditions = {'control': wells[:half].tolist(),
+                  'treated': wells[half:].tolist()}
+    with open(os.path.join(out_dir, 'conditions.txt'), 'w') as f:
+        f.write(repr(conditions))
+    return len(times)
+
+
+def main(argv=None):
+    defaults = plate_spec()
+    parser = argparse.ArgumentParser(
+            description="Write a synthetic MCS Multiwell export.",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("out_dir", help="directory the exports are written to")
+    parser.add_argument("--plate", default='bench', help="plate name")
+    parser.add_argument("--wells", type=int, default=defaults.wells)
+    parser.add_argument("--channels", type=int, default=defaults.channels,
+                        help="electrodes per well")
+    parser.add_argument("--rate", type=float, default=defaults.rate_hz,
+                        help="mean spikes per second and electrode")
+    parser.add_argument("--duration", type=float, default=defaults.duration_s,
+                        help="recording duration in s")
+    parser.add_argument("--burst-fraction", type=float,
+                        default=defaults.burst_fraction,
+                        help="share of the spikes in network bursts")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args(argv)
+
+    spec = plate_spec(wells=args.wells, channels=args.channels,
+                      rate_hz=args.rate, duration_s=args.duration,
+                      burst_fraction=args.burst_fraction, seed=args.seed)
+    count = write_plate(args.out_dir, spec, args.plate)
+    print(f'{count} spikes written to {args.out_dir} ({asdict(spec)})')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Benchmarks of the analysis pipeline on synthetic plates.
+
+Generates a plate (see benchmarks.generate_mcs) for every combination of
+the given sizes, analyzes each with `mea_cli.py run --profile` in a fresh
+process and collects the wall time (and with --memory the peak memory) of
+every stage. The results are written to <work dir>/results.csv (one row
+per plate size, run and stage, for scaling curves) and results.json (the
+median seconds per stage). Given the results.json of an earlier run as
+--baseline, stages that got slower by more than --tolerance are reported
+and the exit code is 1.
+
+    python -m benchmarks.run_benchmarks /tmp/mea-bench --wells 24 96 \\
+        --durations 300 1200 --repeat 3 -- --spike-trains --detect-bursts
+
+Arguments after '--' are passed on to mea_cli.py run.
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+
+import pandas as pd
+
+from benchmarks.generate_mcs import plate_spec, write_plate
+from core.mea_profile import PROFILE_NAME
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLATE_NAME = 'bench'
+SPEC_NAME = 'spec.json'
+
+# Slowdowns of stages faster than this are noise, not regressions
+MIN_REGRESSION_SECONDS = 0.05
+
+
+def ensure_plate(data_dir, spec: plate_spec):
+    """Directory with the exports of spec, generated unless already there."""
+    plate_dir = os.path.join(data_dir, spec.label)
+    spec_file = os.path.join(plate_dir, SPEC_NAME)
+    if os.path.isfile(spec_file):
+        with open(spec_file) as f:
+            if json.load(f)['spec'] == asdict(spec):
+                return plate_dir
+    print(f'Generating {spec.label}')
+    spikes = write_plate(plate_dir, spec, PLATE_NAME)
+    with open(spec_file, 'w') as f:
+        json.dump({'spec': asdict(spec), 'spikes': spikes}, f)
+    return plate_dir
+
+
+def run_once(plate_dir, spec: plate_spec, profile_mode, cli_args):
+    """Analyze a generated plate in a new process, returns its profile."""
+    mins_recorded = max(int(round(spec.duration_s / 60)), 1)
+    command = [sys.executable, os.path.join(REPO_DIR, 'mea_cli.py'), 'run',
+               plate_dir, 'conditions.txt', str(mins_recorded),
+               f'{PLATE_NAME}_spikes.csv', f'{PLATE_NAME}_bursts.csv',
+               f'{PLATE_NAME}_net_bursts.csv', '--no-cache',
+               '--output', 'csv', '--profile']
+    if profile_mode == 'memory':
+        command.append('--profile-memory')
+    command += cli_args
+    start = time.perf_counter()
+    subprocess.run(command, check=True, cwd=REPO_DIR,
+                   stdout=subprocess.DEVNULL)
+    seconds = time.perf_counter() - start
+    with open(os.path.join(plate_dir, PLATE_NAME, PROFILE_NAME)) as f:
+        report = json.load(f)
+    report['process_seconds'] = seconds
+    return report
+
+
+def report_rows(spec: plate_spec, run, report):
+    """One results row per stage of a profile report."""
+    common = dict(asdict(spec), label=spec.label, run=run,
+                  spikes=report['rows']['spikes'],
+                  memory_traced=report['memory_traced'])
+    rows = [dict(common, stage='total', seconds=report['total_seconds'],
+                 max_rss_bytes=report['max_rss_bytes']),
+            dict(common, stage='process', seconds=report['process_seconds'])]
+    for stage in report['stages']:
+        rows.append(dict(common, stage=stage['name'],
+                         seconds=stage['seconds'],
+                         peak_bytes=stage['peak_bytes'],
+                         added_bytes=stage['added_bytes'],
+                         max_rss_bytes=stage['max_rss_bytes']))
+    return rows
+
+
+def summarize(results: pd.DataFrame):
+    """Median seconds (and peak memory) per plate size and stage."""
+    timed = results[~results['memory_traced']]
+    summary = {label: {'spikes': int(group['spikes'].iloc[0]),
+                       'seconds': group.groupby('stage', sort=False)
+                       ['seconds'].median().to_dict()}
+               for label, group in timed.groupby('label', sort=False)}
+    traced = results[results['memory_traced']]
+    for label, group in traced.groupby('label', sort=False):
+        summary.setdefault(label, {'spikes': int(group['spikes'].iloc[0])})
+        summary[label]['peak_bytes'] = (group.groupby('stage', sort=False)
+                                        ['peak_bytes'].max().dropna()
+                                        .astype(int).to_dict())
+    return summary
+
+
+def compare(summary, baseline, tolerance):
+    """(label, stage, baseline s, new s) of every slower stage."""
+    regressions = []
+    for label, result in summary.items():
+        before = baseline.get(label, {}).get('seconds', {})
+        for stage, seconds in result.get('seconds', {}).items():
+            if stage not in before:
+                continue
+            if (seconds > before[stage] * (1 + tolerance)
+                    and seconds - before[stage] > MIN_REGRESSION_SECONDS):
+                regressions.append((label, stage, before[stage], seconds))
+    return regressions
+
+
+def plot_scaling(results: pd.DataFrame, filename):
+    """Median seconds of the top level stages over the spike count."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    timed = results[~results['memory_traced']
+                    & ~results['stage'].str.contains('/')
+                    & (results['stage'] != 'process')]
+    medians = (timed.groupby(['stage', 'spikes'])['seconds'].median()
+               .unstack('stage'))
+    ax = medians.plot(marker='o', logx=True, logy=True)
+    ax.set_xlabel('spikes')
+    ax.set_ylabel('seconds')
+    plt.savefig(filename, bbox_inches='tight')
+    print(f'Scaling curves written to {filename}')
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    cli_args = []
+    if '--' in argv:
+        cli_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+
+    defaults = plate_spec()
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("work_dir",
+                        help="directory for the generated plates and results")
+    parser.add_argument("--wells", type=int, nargs='+',
+                        default=[defaults.wells])
+    parser.add_argument("--channels", type=int, nargs='+',
+                        default=[defaults.channels],
+                        help="electrodes per well")
+    parser.add_argument("--rates", type=float, nargs='+',
+                        default=[defaults.rate_hz],
+                        help="mean spikes per second and electrode")
+    parser.add_argument("--durations", type=float, nargs='+',
+                        default=[defaults.duration_s],
+                        help="recording durations in s")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per plate, the median is compared")
+    parser.add_argument("--memory", action='store_true',
+                        help=("one more run per plate with memory tracing "
+                              "(slower, hence not timed)"))
+    parser.add_argument("--baseline",
+                        help="results.json of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown per stage, 0.25 = 25 %%")
+    parser.add_argument("--plot",
+                        help="write scaling curves to this image file")
+    args = parser.parse_args(argv)
+
+    # Read before it is possibly overwritten by this run's results
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    data_dir = os.path.join(args.work_dir, 'data')
+    rows = []
+    for wells, channels, rate, duration in itertools.product(
+            args.wells, args.channels, args.rates, args.durations):
+        spec = plate_spec(wells=wells, channels=channels, rate_hz=rate,
+                          duration_s=duration)
+        plate_dir = ensure_plate(data_dir, spec)
+        modes = ['time'] * args.repeat + (['memory'] if args.memory else [])
+        for run, mode in enumerate(modes):
+            report = run_once(plate_dir, spec, mode, cli_args)
+            rows += report_rows(spec, run, report)
+            print(f"{spec.label} run {run} ({mode}): "
+                  f"{report['total_seconds']:.2f} s, "
+                  f"{report['rows']['spikes']} spikes")
+
+    results = pd.DataFrame(rows)
+    results.to_csv(os.path.join(args.work_dir, 'results.csv'), index=False)
+    summary = summarize(results)
+    with open(os.path.join(args.work_dir, 'results.json'), 'w') as f:
+        json.dump({'cli_args': cli_args, 'plates': summary}, f, indent=2)
+    print(f'Results written to {args.work_dir}')
+
+    if args.plot:
+        plot_scaling(results, args.plot)
+
+    if baseline is not None:
+        if baseline.get('cli_args') != cli_args:
+            print(f"Warning: the baseline was run with {baseline.get('cli_args')}")
+        regressions = compare(summary, baseline['plates'], args.tolerance)
+        for label, stage, before, after in regressions:
+            print(f'[slower] {label} {stage}: {before:.3f} s -> {after:.3f} s')
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 import pyabf
+from collections.abc import Mapping
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
 from dataclasses import dataclass
+import glob
 import numpy as np
-from typing import Dict, List
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Union
 import os
 
 @dataclass
@@ -30,9 +35,110 @@ class sweep_data:
 
     sweeps: Dict[int, Dict[int, sweep]]
 
+class _abf_data_map():
+    """Stand-in for pyabf's ABF.data backed by a memory map of the file.
+
+    ABF.data holds the scaled samples of the whole file as a channel x point
+    array. This reads (and scales, exactly like pyabf) only the points that
+    are indexed, so setSweep() no longer loads the whole file.
+    """
+    def __init__(self, abf, filepath):
+        point_count = abf.dataPointCount // abf.channelCount
+        self.raw = np.memmap(filepath, dtype=abf._dtype, mode='r',
+                             offset=abf.dataByteStart,
+                             shape=(point_count, abf.channelCount))
+        self.shape = (abf.channelCount, point_count)
+        self.scaled = abf._dtype == np.int16
+        self.gain = abf._dataGain
+        self.offset = abf._dataOffset
+
+    def __getitem__(self, key):
+        channel, points = key
+        y = self.raw[points, channel].astype(np.float32)
+        if self.scaled:
+            y = np.multiply(y, self.gain[channel])
+            y = np.add(y, self.offset[channel])
+        return y
+
+
+class lazy_sweep():
+    """A sweep (same fields as sweep) that is read on first access.
+
+    All sweeps of a file share one time axis.
+    """
+    def __init__(self, source, channel, sweep_number):
+        self._source = source
+        self._channel = channel
+        self._sweep_number = sweep_number
+        self._loaded = None
+
+    def _load(self):
+        if self._loaded is None:
+            self._loaded = self._source.read_sweep(self._channel,
+                                                   self._sweep_number)
+        return self._loaded
+
+    @property
+    def x(self):
+        # The time axis is known without reading the samples
+        if self._loaded is None:
+            return self._source.time_axis(self._source.abf.sweepPointCount)
+        return self._loaded.x
+
+    @property
+    def y(self):
+        return self._load().y
+
+    @property
+    def s(self):
+        return self._load().s
+
+    @property
+    def x_label(self):
+        return self._load().x_label
+
+    @property
+    def y_label(self):
+        return self._load().y_label
+
+    @property
+    def s_label(self):
+        return self._load().s_label
+
+    @property
+    def loaded(self):
+        return self._loaded is not None
+
+    def read_y(self, first=0, last=None):
+        """Samples first to last, read without keeping them."""
+        if self._loaded is not None:
+            return self._loaded.y[first:last]
+        return self._source.read_samples(self._channel, self._sweep_number,
+                                         first, last)
+
+
+class lazy_sweeps(Mapping):
+    """Sweep number -> lazy_sweep of one channel."""
+    def __init__(self, source, channel, sweep_count):
+        self._sweeps = {s: lazy_sweep(source, channel, s)
+                        for s in range(sweep_count)}
+
+    def __getitem__(self, sweep_number):
+        return self._sweeps[sweep_number]
+
+    def __iter__(self):
+        return iter(self._sweeps)
+
+    def __len__(self):
+        return len(self._sweeps)
+
+
 class abf_data():
     def __init__(self, filename):
-        self.abf = pyabf.ABF(filename)
+        # The samples are only read when sweeps are accessed
+        self.abf = pyabf.ABF(filename, loadData=False)
+        self._lock = threading.Lock()
+        self._time_axis = np.zeros(0)
 
         self.filepath = os.path.abspath(filename)
         self.filename = os.path.basename(filename)
@@ -44,19 +150,74 @@ class abf_data():
         self.sweep_count = self.abf.sweepCount
 
 
-    def get_data(self):
-        sweeps = dict()
-        for c in range(self.channel_count):
-            sweeps[c] = dict()
-            for s in range(self.sweep_count):
-                self.abf.setSweep(channel=c, sweepNumber=s)
-                sweeps[c][s] = sweep(x=self.abf.sweepX, 
-                                     y=self.abf.sweepY,
-                                     s=self.abf.sweepC,
-                                     x_label=self.abf.sweepLabelX,
-                                     y_label=self.abf.sweepLabelY,
-                                     s_label=self.abf.sweepLabelC,)
-        
+    def use_memmap(self):
+        """Read sweeps through a memory map instead of loading the file."""
+        if not hasattr(self.abf, 'data'):
+            self.abf.data = _abf_data_map(self.abf, self.filepath)
+
+    def time_axis(self, point_count):
+        """Shared time axis (in s) of the first point_count points."""
+        if len(self._time_axis) < point_count:
+            self._time_axis = (np.arange(point_count)
+                               * self.abf.dataSecPerPoint)
+        return self._time_axis[:point_count]
+
+    def sweep_points(self, sweep_number):
+        """First and end point of a sweep in the file, like setSweep."""
+        abf = self.abf
+        lengths = getattr(abf, '_synchArraySection', None)
+        lengths = lengths.lLength if lengths is not None else []
+        if abf.sweepCount > 1 and len(set(lengths)) > 1:
+            # Variable length sweeps
+            start = sum(length // abf.channelCount
+                        for length in lengths[:sweep_number])
+            return start, start + lengths[sweep_number] // abf.channelCount
+        start = abf.sweepPointCount * sweep_number
+        return start, start + abf.sweepPointCount
+
+    def read_samples(self, channel, sweep_number, first=0, last=None):
+        """Points first to last of one sweep, only those are read.
+
+        Unlike read_sweep, the state of the pyabf object is not changed, and
+        with the memory map (see use_memmap) the rest of the sweep is not
+        read.
+        """
+        self.use_memmap()
+        start, end = self.sweep_points(sweep_number)
+        first, last, _ = slice(first, last).indices(end - start)
+        return self.abf.data[channel, start + first:start + max(last, first)]
+
+    def read_sweep(self, channel, sweep_number):
+        """Read one sweep of one channel."""
+        # setSweep changes the state of the (shared) pyabf object
+        with self._lock:
+            self.abf.setSweep(channel=channel, sweepNumber=sweep_number)
+            y = self.abf.sweepY
+            return sweep(x=self.time_axis(len(y)),
+                         y=y,
+                         s=self.abf.sweepC,
+                         x_label=self.abf.sweepLabelX,
+                         y_label=self.abf.sweepLabelY,
+                         s_label=self.abf.sweepLabelC,)
+
+    def get_data(self, lazy=True):
+        """All sweeps of the file as sweep_data.
+
+        With lazy, sweeps are lazy_sweep objects that are read from a memory
+        map of the file when they are first accessed, otherwise the whole
+        file is loaded and every sweep read right away.
+        """
+        if lazy:
+            self.use_memmap()
+            sweeps = {c: lazy_sweeps(self, c, self.sweep_count)
+                      for c in range(self.channel_count)}
+        else:
+            sweeps = dict()
+            for c in range(self.channel_count):
+                sweeps[c] = dict()
+                for s in range(self.sweep_count):
+                    sweeps[c][s] = self.read_sweep(c, s)
+
         return sweep_data(filepath = self.filepath,
                           filename=self.filename,
                           protocol=self.protocol,
@@ -68,4 +229,62 @@ class abf_data():
         
 
 
-        print(self.abf.getAllYs())
\ No newline at end of file
+        print(self.abf.getAllYs())
+
+
+@dataclass
+class abf_load_result:
+    filepath: str
+    data: Optional[sweep_data] = None
+    error: Optional[str] = None
+
+
+def expand_abf_files(files: Union[str, Iterable[str]]) -> List[str]:
+    """File names from a glob pattern or a list of names/patterns."""
+    if isinstance(files, str):
+        files = [files]
+    expanded = []
+    for f in files:
+        if glob.has_magic(f):
+            expanded += sorted(glob.glob(f, recursive=True))
+        else:
+            expanded.append(f)
+    return expanded
+
+
+def _load_abf(filename, lazy):
+    try:
+        data = abf_data(filename).get_data(lazy=lazy)
+    except Exception as e:
+        return abf_load_result(filepath=os.path.abspath(filename),
+                               error=f'{type(e).__name__}: {e}')
+    return abf_load_result(filepath=data.filepath, data=data)
+
+
+def read_abf_files(files: Union[str, Iterable[str]], workers=4,
+                   processes=False, lazy=False) -> Iterator[abf_load_result]:
+    """Open and decode many ABF files concurrently.
+
+    files is a glob pattern or a list of file names/patterns. The files are
+    loaded by a pool of worker threads (or processes) and an
+    abf_load_result is yielded for each file as soon as it is done, in
+    completion order. A file that cannot be read is yielded with its error
+    instead of aborting the batch. By default the sweeps are read right
+    away, with lazy they are read on access (thread pool only, lazy sweeps
+    cannot be sent between processes).
+
+        for result in read_abf_files(file_list, workers=len(file_list)):
+            print(result.filepath, result.error or result.data.sweep_count)
+    """
+    if processes and lazy:
+        raise ValueError('lazy sweeps can only be loaded by threads')
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    pool = pool_class(max_workers=workers)
+    try:
+        futures = [pool.submit(_load_abf, f, lazy)
+                   for f in expand_abf_files(files)]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Do not wait for files nobody asks for anymore
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,243 @@
+import os
+
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from core.file_cache import DEFAULT_CACHE_DIR, file_cache
+
+# Samples per block of the finest envelope level and the factor between
+# levels, each level has LEVEL_FACTOR times fewer blocks than the one before
+BASE_BLOCK = 16
+LEVEL_FACTOR = 4
+# Levels are added until one has at most this many blocks
+MIN_BLOCKS = 512
+
+# Envelope pyramids of ABF files are kept apart from the parsed tables, the
+# two caches have their own size limits
+DEFAULT_LOD_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'abf-lod')
+DEFAULT_LOD_CACHE_BYTES = 2 * 1024 ** 3
+LOD_CACHE_VERSION = 1
+# Finer levels would make the cache about as large as the recording, the
+# few samples of such deep zooms are read from the file instead
+CACHED_MIN_BLOCK = 256
+_LEVEL_FIELDS = ['min_index', 'min_value', 'max_index', 'max_value']
+
+
+def _pad_to(arr, multiple):
+    missing = -len(arr) % multiple
+    if missing:
+        arr = np.pad(arr, (0, missing), mode='edge')
+    return arr
+
+
+class envelope_level():
+    """Min and max (and their sample indices) of consecutive blocks."""
+    def __init__(self, block, min_index, min_value, max_index, max_value):
+        self.block = block
+        self.min_index = min_index
+        self.min_value = min_value
+        self.max_index = max_index
+        self.max_value = max_value
+
+    def __len__(self):
+        return len(self.min_index)
+
+    @classmethod
+    def from_samples(cls, y, block):
+        n = len(y)
+        blocks = _pad_to(np.asarray(y), block).reshape(-1, block)
+        offsets = np.arange(len(blocks)) * block
+        imin = blocks.argmin(axis=1)
+        imax = blocks.argmax(axis=1)
+        rows = np.arange(len(blocks))
+        # Padding repeats the last sample, so clipping keeps the same value
+        return cls(block,
+                   np.minimum(offsets + imin, n - 1), blocks[rows, imin],
+                   np.minimum(offsets + imax, n - 1), blocks[rows, imax])
+
+    def coarser(self, factor=LEVEL_FACTOR):
+        """Next level, combining factor blocks of this one."""
+        groups = len(self) // factor + bool(len(self) % factor)
+        rows = np.arange(groups)
+
+        def reduce(index, value, arg):
+            index = _pad_to(index, factor).reshape(-1, factor)
+            value = _pad_to(value, factor).reshape(-1, factor)
+            pick = arg(value, axis=1)
+            return index[rows, pick], value[rows, pick]
+
+        min_index, min_value = reduce(self.min_index, self.min_value,
+                                      np.argmin)
+        max_index, max_value = reduce(self.max_index, self.max_value,
+                                      np.argmax)
+        return envelope_level(self.block * factor, min_index, min_value,
+                              max_index, max_value)
+
+    def points(self, first, last):
+        """Sample indices and values of the extrema of blocks first to last.
+
+        Both extrema of a block are returned in sample order.
+        """
+        lo_index = self.min_index[first:last]
+        hi_index = self.max_index[first:last]
+        lo_value = self.min_value[first:last]
+        hi_value = self.max_value[first:last]
+        swap = lo_index > hi_index
+        index = np.column_stack([np.where(swap, hi_index, lo_index),
+                                 np.where(swap, lo_index, hi_index)])
+        value = np.column_stack([np.where(swap, hi_value, lo_value),
+                                 np.where(swap, lo_value, hi_value)])
+        return index.ravel(), value.ravel()
+
+
+class lod_trace():
+    """Level of detail version of one trace (e.g. a sweep).
+
+    A min/max envelope pyramid is computed once in NumPy. view() returns
+    the minimum and maximum of every block of the level whose blocks are
+    closest to the samples per pixel, in sample order, which keeps spikes
+    and the outline of the trace visible. With levels LEVEL_FACTOR = 4
+    apart that is about one to four points per pixel of the visible range.
+    Zoomed in far enough it returns the raw samples.
+
+    y are the samples or a function y(first, last) reading samples first
+    to last. Samples read through it are not kept: the whole trace is read
+    once to build the levels, deep zooms read the visible samples only.
+    With precomputed levels (e.g. from the cache) the samples are only read
+    for deep zooms.
+    """
+    def __init__(self, x, y: Union[np.ndarray,
+                                   Callable[[int, int], np.ndarray]],
+                 levels: Optional[List[envelope_level]] = None,
+                 base_block=BASE_BLOCK, factor=LEVEL_FACTOR,
+                 min_blocks=MIN_BLOCKS):
+        self.x = np.asarray(x)
+        self._y = y if callable(y) else np.asarray(y)
+        if levels is not None:
+            self.levels = levels
+            return
+        self.levels: List[envelope_level] = []
+        if len(self.x) > 2 * min_blocks:
+            level = envelope_level.from_samples(self.samples(), base_block)
+            self.levels.append(level)
+            while len(level) > min_blocks:
+                level = level.coarser(factor)
+                self.levels.append(level)
+
+    def __len__(self):
+        return len(self.x)
+
+    def samples(self, first=0, last=None):
+        """Raw samples first to last, read every time if y is a function."""
+        if callable(self._y):
+            return np.asarray(self._y(first, last))
+        return self._y[first:last]
+
+    def view(self, width: int, x_range: Optional[Tuple[float, float]] = None):
+        """x and y to draw the trace width pixels wide over x_range."""
+        first, last = 0, len(self)
+        if x_range is not None:
+            # Keep one sample outside on each side, so lines reach the border
+            first = max(np.searchsorted(self.x, x_range[0], 'left') - 1, 0)
+            last = min(np.searchsorted(self.x, x_range[1], 'right') + 1,
+                       len(self))
+        width = max(int(width), 1)
+        samples_per_pixel = (last - first) / width
+
+        # The coarsest level with blocks of at most two pixels, i.e. the one
+        # closest to a block per pixel (levels are LEVEL_FACTOR = 4 apart)
+        level = None
+        for candidate in self.levels:
+            if candidate.block <= 2 * samples_per_pixel:
+                level = candidate
+        if level is not None:
+            index, value = level.points(first // level.block,
+                                        -(-last // level.block))
+        elif samples_per_pixel >= 2:
+            # Finer than the pyramid, bucket the few visible samples directly
+            level = envelope_level.from_samples(self.samples(first, last),
+                                                int(samples_per_pixel))
+            index, value = level.points(0, len(level))
+            index = index + first
+        else:
+            return self.x[first:last], self.samples(first, last)
+        return self.x[index], value
+
+
+def _save_traces(f, traces: Dict[int, Dict[int, lod_trace]]):
+    arrays = {}
+    for c, sweeps in traces.items():
+        for s, trace in sweeps.items():
+            levels = [level for level in trace.levels
+                      if level.block >= CACHED_MIN_BLOCK]
+            for i, level in enumerate(levels):
+                arrays[f'{c}/{s}/{i}/block'] = np.array(level.block)
+                for field in _LEVEL_FIELDS:
+                    arrays[f'{c}/{s}/{i}/{field}'] = getattr(level, field)
+    np.savez(f, **arrays)
+
+
+def _load_levels(arrays, channel, sweep_number):
+    levels = []
+    while f'{channel}/{sweep_number}/{len(levels)}/block' in arrays:
+        prefix = f'{channel}/{sweep_number}/{len(levels)}'
+        levels.append(envelope_level(
+                int(arrays[f'{prefix}/block']),
+                *[arrays[f'{prefix}/{field}'] for field in _LEVEL_FIELDS]))
+    return levels
+
+
+def _read_samples(sweep, first, last):
+    # Lazy sweeps read the slice from the memory map without keeping it
+    if hasattr(sweep, 'read_y'):
+        return sweep.read_y(first, last)
+    return sweep.y[first:last]
+
+
+def sweep_traces(data, progress=None, cache: Optional[file_cache] = None):
+    """lod_trace of every sweep of a sweep_data, channel -> sweep -> trace.
+
+    progress(done, total) is called after each sweep. With a cache (see
+    core.file_cache), the envelope pyramids of a file are stored on the
+    first load (without the finest levels), later loads take them from the
+    cache and only read samples when zoomed in deeply. The cache entry is
+    keyed by the content of the ABF file, a changed file gets new pyramids.
+    """
+    total = sum(len(sweeps) for sweeps in data.sweeps.values())
+    key = cached = None
+    if cache is not None:
+        key = cache.key(data.filepath,
+                        f'lod:v{LOD_CACHE_VERSION}:{BASE_BLOCK}:'
+                        f'{LEVEL_FACTOR}:{MIN_BLOCKS}:{CACHED_MIN_BLOCK}')
+        path = cache.get(key, 'npz')
+        if path is not None:
+            with np.load(path) as arrays:
+                cached = {(c, s): _load_levels(arrays, c, s)
+                          for c, sweeps in data.sweeps.items()
+                          for s in sweeps}
+
+    traces = dict()
+    done = 0
+    for c, sweeps in data.sweeps.items():
+        traces[c] = dict()
+        for s, sweep in sweeps.items():
+            # Default argument, every lambda keeps its own sweep
+            samples = (lambda first, last, sweep=sweep:
+                       _read_samples(sweep, first, last))
+            levels = cached[(c, s)] if cached is not None else None
+            traces[c][s] = lod_trace(sweep.x, samples, levels)
+            done += 1
+            if progress is not None:
+                progress(done, total)
+
+    if cache is not None and cached is None:
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                _save_traces(f, traces)
+        cache.put(key, 'npz', write)
+    return traces
+
+
+def default_lod_cache():
+    """Cache for envelope pyramids in the user's cache directory."""
+    return file_cache(DEFAULT_LOD_CACHE_DIR, DEFAULT_LOD_CACHE_BYTES)
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'multiwell-mea')
+DEFAULT_CACHE_BYTES = 10 * 1024 ** 3
+
+_HASH_BLOCK = 4 * 1024 ** 2
+
+
+def content_hash(filename):
+    """blake2b hash of the whole file content."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class file_cache():
+    """Size capped on-disk cache of files derived from source files.
+
+    Entries are keyed by the content hash of the source file plus a variant
+    string (what was derived and how). Hashing a multi-GB file is not free,
+    so the hash is remembered per source path, size and mtime and only
+    recomputed when one of those changes. The least recently used entries
+    are evicted once the cache grows beyond max_bytes.
+
+    There is no central index, every entry is a single file whose mtime is
+    its last use, so several processes can share one cache directory.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR,
+                 max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.entry_dir = os.path.join(cache_dir, 'entries')
+        self.source_dir = os.path.join(cache_dir, 'sources')
+        os.makedirs(self.entry_dir, exist_ok=True)
+        os.makedirs(self.source_dir, exist_ok=True)
+
+    def fingerprint(self, filename):
+        """Path, size, mtime and content hash of a source file."""
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        fingerprint = dict(path=filename, size=stat.st_size,
+                           mtime_ns=stat.st_mtime_ns)
+
+        memo = os.path.join(
+                self.source_dir,
+                hashlib.blake2b(filename.encode(), digest_size=16).hexdigest()
+                + '.json')
+        try:
+            with open(memo, 'r') as f:
+                known = json.load(f)
+            if all(known.get(k) == v for k, v in fingerprint.items()):
+                return known
+        except (OSError, ValueError):
+            pass
+
+        fingerprint['hash'] = content_hash(filename)
+        self._write_atomic(memo, json.dumps(fingerprint).encode())
+        return fingerprint
+
+    def key(self, filename, variant):
+        """Cache key of the variant derived from filename."""
+        fingerprint = self.fingerprint(filename)
+        return hashlib.blake2b(f'{fingerprint["hash"]}:{variant}'.encode(),
+                               digest_size=16).hexdigest()
+
+    def path(self, key, ext):
+        return os.path.join(self.entry_dir, f'{key}.{ext}')
+
+    def get(self, key, ext):
+        """Path of a cached entry (marking it as used) or None."""
+        path = self.path(key, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, ext, write):
+        """Store an entry, write(tmp_path) creates the file.
+
+        Returns the path of the entry.
+        """
+        path = self.path(key, ext)
+        fd, tmp = tempfile.mkstemp(dir=self.entry_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+        return path
+
+    def entries(self):
+        """(path, size, last use) of all entries, least recently used first."""
+        entries = []
+        for entry in os.scandir(self.entry_dir):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda e: e[2])
+
+    def size(self):
+        return sum(e[1] for e in self.entries())
+
+    def evict(self):
+        """Remove least recently used entries until below max_bytes."""
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Remove all entries and remembered source hashes."""
+        for d in [self.entry_dir, self.source_dir]:
+            shutil.rmtree(d, ignore_errors=True)
+            os.makedirs(d, exist_ok=True)
+
+    def _write_atomic(self, path, data: bytes):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
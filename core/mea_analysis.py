@@ -0,0 +1,329 @@
+import ast
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from core.mea_profile import stage
+from core.mea_spike_trains import (SPIKE_TRAIN_OUTPUT_NAMES,
+                                   spike_train_options, spike_train_tables)
+from core.mea_windows import (WINDOWED_OUTPUT_NAME, window_options,
+                              windowed_metrics)
+
+# Columns of the MCS exports that are not used by the analysis
+UNNEEDED_COLS = ['Compound ID', 'Compound Name', 'Experiment',
+                 'Dose Label', 'Dose [pM]']
+
+AGG_COLS = ['Channel Label', 'Well Label']
+
+# Names of the tables returned by analyze(), also used as output file names
+OUTPUT_NAMES = ['spike_counts', 'spike_counts_per_min', 'burst_counts',
+                'burst_counts_per_min', 'spont_spike_counts',
+                'spont_spike_ratio', 'avg_burst_duration',
+                'avg_spike_freq_per_burst', 'avg_spike_count_per_burst',
+                'avg_inter_burst_interval', 'net_bursts_count_per_min',
+                'net_bursts_avg_duration', 'net_bursts_spike_count_per_min',
+                'net_bursts_spike_freq', 'net_bursts_avg_ibi',
+                'net_bursts_ibi_coef_of_var']
+
+
+def output_names(spike_trains: Optional[spike_train_options] = None,
+                 windows: Optional[window_options] = None):
+    """Names of the tables analyze() returns with these options."""
+    names = list(OUTPUT_NAMES)
+    if spike_trains is not None:
+        names += SPIKE_TRAIN_OUTPUT_NAMES
+    if windows is not None:
+        names.append(WINDOWED_OUTPUT_NAME)
+    return names
+
+
+def read_conditions(conditions_file: str) -> Dict[str, List[str]]:
+    """Read a conditions file (python dict literal of line -> wells).
+
+    Raises a ValueError if a well is assigned more than once.
+    """
+    with open(conditions_file, 'r') as f:
+        conditions = ast.literal_eval(f.read())
+    condition_map(conditions)
+    return conditions
+
+
+def condition_map(conditions: Dict[str, List[str]]) -> Dict[str, str]:
+    """Well -> its condition label ('<line>_<well>'), in file order.
+
+    Raises a ValueError listing the wells that are assigned more than once,
+    to several lines or twice to the same one.
+    """
+    mapping = dict()
+    lines = dict()
+    for line, wells in conditions.items():
+        for well in wells:
+            mapping[well] = f'{line}_{well}'
+            lines.setdefault(well, []).append(line)
+    duplicates = {well: found for well, found in lines.items()
+                  if len(found) > 1}
+    if duplicates:
+        raise ValueError('Wells assigned more than once in the conditions: '
+                         + ', '.join(f'{well} ({", ".join(found)})'
+                                     for well, found in duplicates.items()))
+    return mapping
+
+
+def get_condition_labels(conditions: Dict[str, List[str]]) -> List[str]:
+    """Well labels prefixed with their cell line/condition, in file order."""
+    condition_labels = []
+    for k, v in conditions.items():
+        condition_labels += [f'{k}_{sv}' for sv in v]
+    return condition_labels
+
+
+def inter_burst_intervals(arr, group_col):
+    """Inter burst intervals between consecutive rows of the same group.
+
+    The interval of a burst is its start time minus the end time of the
+    previous row, provided both rows belong to the same ``group_col`` run.
+    The first burst of every run gets NaN, as does every row of a frame with
+    fewer than two rows.
+    """
+    same_group = arr[group_col].eq(arr[group_col].shift())
+    ibi = (arr['Start timestamp [µs]']
+           - arr['End timestamp [µs]'].shift()).astype('float64')
+    return ibi.where(same_group)
+
+
+def relabel_wells(well_labels, mapping: Dict[str, str],
+                  condition_labels: List[str]):
+    """Well labels as categoricals of their condition labels.
+
+    mapping is condition_map()'s well -> condition label. Only the
+    categories are renamed, not the rows. The categories are
+    condition_labels followed by the wells that are not in mapping, so
+    tables grouped by well are already in condition order. Returns the
+    relabeled column and the unassigned wells.
+    """
+    if not isinstance(well_labels.dtype, pd.CategoricalDtype):
+        well_labels = well_labels.astype('category')
+    wells = well_labels.cat.categories.astype(str)
+    unassigned = [well for well in wells if well not in mapping]
+    well_labels = well_labels.cat.rename_categories(
+            [mapping.get(well, well) for well in wells])
+    return (well_labels.cat.set_categories(condition_labels + unassigned),
+            unassigned)
+
+
+def preprocess(spikes, bursts, net_bursts, conditions):
+    """Prepare the raw MCS tables for the metric computation.
+
+    Computes end time stamps and inter burst intervals, drops the columns
+    that are not needed and prefixes every well label with the cell
+    line/condition it contains (see relabel_wells). Wells that are not in
+    conditions keep their label and are left out of the tables, they are
+    reported. The input frames are left untouched, the processed copies are
+    returned.
+    """
+    spikes = spikes.drop(columns=UNNEEDED_COLS, errors='ignore')
+    bursts = bursts.drop(columns=UNNEEDED_COLS, errors='ignore')
+    net_bursts = net_bursts.drop(columns=UNNEEDED_COLS, errors='ignore')
+
+    # Compute End time stamps & inter burst intervals
+    for arr in [bursts, net_bursts]:
+        arr['End timestamp [µs]'] = (arr['Start timestamp [µs]']
+                                      + arr['Duration [µs]'])
+    # Bursts are consecutive per channel, network bursts per well
+    bursts["inter burst interval [µs]"] = inter_burst_intervals(
+            bursts, 'Channel Label')
+    net_bursts["inter burst interval [µs]"] = inter_burst_intervals(
+            net_bursts, 'Well Label')
+
+    print("End timestamps and inter burst intervals computed")
+
+    # make well label specify the condition/cell line contained in the well
+    mapping = condition_map(conditions)
+    condition_labels = list(mapping.values())
+    unassigned = set()
+    for arr in [spikes, bursts, net_bursts]:
+        arr['Well Label'], missing = relabel_wells(arr['Well Label'], mapping,
+                                                   condition_labels)
+        unassigned.update(missing)
+    if unassigned:
+        print(f"Warning: wells {', '.join(sorted(unassigned))} are not in "
+              "the conditions file and left out")
+
+    print("Cell lines/conditions assigned to wells")
+
+    return spikes, bursts, net_bursts
+
+
+def spike_count_tables(spikes, bursts, condition_labels, mins_recorded):
+    """Spike and burst counts per channel (rows) and well (columns)."""
+    # In the following we will use group by statements which essentially
+    # perform the the summation of spikes for each group and channels.
+    # These however turn the data into the format [Channel ID, Well ID, Value]
+    # (i.e. each row contains the desired value (e.g. #spikes) of one channel
+    # in one well). However the user wants to have the data in the format
+    # [Channel ID, Well 0, Well 1, ..., Well N] (i.e. each row contains the
+    # desired value (e.g. #spikes) of one channel in all wells). To achieve
+    # this we use the unstack function, which does exactly this and fills empty
+    # fields with 0.
+    if 'Spike Count' in spikes:
+        # Spikes already counted per channel and well (streaming mode)
+        spike_counts = (spikes.groupby(AGG_COLS, observed=True)
+            ['Spike Count'].sum())
+    else:
+        spike_counts = spikes.groupby(AGG_COLS, observed=True).size()
+    spike_counts = (spike_counts
+        .unstack(fill_value=0).reindex(columns=condition_labels, fill_value=0))
+    burst_counts = (bursts.groupby(AGG_COLS, observed=True).size()
+        .unstack(fill_value=0).reindex(columns=condition_labels, fill_value=0))
+    burst_spike_counts = (bursts.groupby(AGG_COLS, observed=True)
+        ['Spike Count'].sum()
+        .unstack(fill_value=0).reindex(columns=condition_labels, fill_value=0))
+
+    spike_counts_per_min = spike_counts / mins_recorded
+    burst_counts_per_min = burst_counts / mins_recorded
+
+    spon_spike_counts = spike_counts - burst_spike_counts
+    spon_spike_ratio = (spon_spike_counts / spike_counts * 100).fillna(0)
+
+    spike_counts.index = spike_counts.index.set_names(
+        'Spike Count per Well and Channel')
+    spike_counts_per_min.index = spike_counts_per_min.index.set_names(
+        'Spike Counts per min [1/min] per Well and Channel')
+    burst_counts.index = burst_counts.index.set_names(
+        'Burst Counts per Well and Channel')
+    burst_counts_per_min.index = burst_counts_per_min.index.set_names(
+        'Burst Counts per min [1/min] per Well and Channel')
+    spon_spike_counts.index = spon_spike_counts.index.set_names(
+        "Spontaneous Spike Counts per Well and Channel")
+    spon_spike_ratio.index = spon_spike_ratio.index.set_names(
+        "Spontaneous Spike Ratio [%] per Well and Channel")
+
+    return {'spike_counts': spike_counts,
+            'spike_counts_per_min': spike_counts_per_min,
+            'burst_counts': burst_counts,
+            'burst_counts_per_min': burst_counts_per_min,
+            'spont_spike_counts': spon_spike_counts,
+            'spont_spike_ratio': spon_spike_ratio}
+
+
+def burst_tables(bursts, condition_labels):
+    """Burst averages per channel (rows) and well (columns)."""
+    avg_burst_duration = (bursts.groupby(AGG_COLS, observed=True)['Duration [µs]'].mean()
+        .unstack()).reindex(columns=condition_labels)
+    avg_spike_freq = (bursts.groupby(AGG_COLS, observed=True)['Spike Frequency [Hz]'].mean()
+        .unstack()).reindex(columns=condition_labels)
+    avg_spike_count = (bursts.groupby(AGG_COLS, observed=True)['Spike Count'].mean()
+        .unstack()).reindex(columns=condition_labels)
+    avg_inter_burst_interval = (bursts.groupby(AGG_COLS, observed=True)
+        ['inter burst interval [µs]'].mean()
+        .unstack()).reindex(columns=condition_labels)
+
+    avg_burst_duration.index = avg_burst_duration.index.set_names(
+        "Burst Average Duration [µs] per Well and Channel")
+    avg_spike_freq.index = avg_spike_freq.index.set_names(
+        "Burst Average Spike Frequency [Hz] per Well and Channel")
+    avg_spike_count.index = avg_spike_count.index.set_names(
+        "Burst Average Spike Count per Well and Channel")
+    avg_inter_burst_interval.index = avg_inter_burst_interval.index.set_names(
+        "Average Inter-Burst Interval [µs] per Well and Channel")
+
+    return {'avg_burst_duration': avg_burst_duration,
+            'avg_spike_freq_per_burst': avg_spike_freq,
+            'avg_spike_count_per_burst': avg_spike_count,
+            'avg_inter_burst_interval': avg_inter_burst_interval}
+
+
+def net_burst_tables(net_bursts, condition_labels, mins_recorded):
+    """Network burst statistics per well."""
+    by_well = net_bursts.groupby(['Well Label'], observed=True)
+
+    nb_numbers = (by_well.size()
+        .reindex(index=condition_labels, fill_value=0) / mins_recorded)
+    nb_duration = (by_well['Duration [µs]'].mean()
+        .reindex(index=condition_labels))
+    nb_spike_count = (by_well['Spike Count'].mean()
+        .reindex(index=condition_labels))
+    nb_spike_freq = (by_well['Spike Frequency [Hz]'].mean()
+        .reindex(index=condition_labels))
+    nb_avg_inter_burst_interval = (by_well['inter burst interval [µs]'].mean()
+        .reindex(index=condition_labels))
+    nb_ibi_coef_of_var = (by_well['inter burst interval [µs]'].std()
+        / nb_avg_inter_burst_interval).reindex(index=condition_labels)
+
+    nb_numbers.rename("Network Burst Count per Well", inplace=True)
+    nb_duration.rename("Network Burst Average Duration [µs] per Well",
+                       inplace=True)
+    nb_spike_count.rename("Network Burst Average Spike Count per Well",
+                          inplace=True)
+    nb_spike_freq.rename("Network Burst Average Spike Frequency [Hz] per Well",
+                         inplace=True)
+    nb_avg_inter_burst_interval.rename("Network Average Inter-Burst Interval"
+                                       "[µs] per Well", inplace=True)
+    nb_ibi_coef_of_var.rename("Network Inter-Burst Interval Coefficient of"
+                              " Variation per Well", inplace=True)
+
+    return {'net_bursts_count_per_min': nb_numbers,
+            'net_bursts_avg_duration': nb_duration,
+            'net_bursts_spike_count_per_min': nb_spike_count,
+            'net_bursts_spike_freq': nb_spike_freq,
+            'net_bursts_avg_ibi': nb_avg_inter_burst_interval,
+            'net_bursts_ibi_coef_of_var': nb_ibi_coef_of_var}
+
+
+def _window_tables(spikes, bursts, net_bursts, condition_labels,
+                   mins_recorded):
+    tables = spike_count_tables(spikes, bursts, condition_labels,
+                                mins_recorded)
+    tables.update(burst_tables(bursts, condition_labels))
+    tables.update(net_burst_tables(net_bursts, condition_labels,
+                                   mins_recorded))
+    return tables
+
+
+def analyze(spikes, bursts, net_bursts, conditions, mins_recorded,
+            spike_trains: Optional[spike_train_options] = None,
+            windows: Optional[window_options] = None):
+    """Compute every metric table of one plate in memory.
+
+    Takes the spikes, bursts and network bursts tables as exported by the
+    MCS Multiwell software plus the conditions mapping (line -> wells) and
+    returns a dict of output name -> table (DataFrame per channel and well,
+    Series per well for network bursts). The output names are the file names
+    the tables are written to. Instead of one row per spike, spikes may also
+    hold spike counts per channel and well in a 'Spike Count' column (see
+    core.mea_io.count_spikes_chunked). With spike_trains options, the spike
+    train metrics (see core.mea_spike_trains) are computed as well, with
+    windows options the metric tables of every time window as one tidy
+    table (see core.mea_windows). Both need the spike time stamps.
+    """
+    condition_labels = get_condition_labels(conditions)
+    with stage('preprocess'):
+        spikes, bursts, net_bursts = preprocess(spikes, bursts, net_bursts,
+                                                conditions)
+
+    tables = dict()
+    print("Calc spike counts")
+    with stage('spike_counts'):
+        tables.update(spike_count_tables(spikes, bursts, condition_labels,
+                                         mins_recorded))
+    print("Calculate burst quantities")
+    with stage('bursts'):
+        tables.update(burst_tables(bursts, condition_labels))
+    print("Calculate network burst quantities")
+    with stage('net_bursts'):
+        tables.update(net_burst_tables(net_bursts, condition_labels,
+                                       mins_recorded))
+    if spike_trains is not None:
+        print("Calculate spike train metrics")
+        with stage('spike_trains'):
+            tables.update(spike_train_tables(spikes, condition_labels,
+                                             mins_recorded, spike_trains))
+    if windows is not None:
+        print("Calculate windowed metrics")
+        with stage('windows'):
+            tables[WINDOWED_OUTPUT_NAME] = windowed_metrics(
+                    spikes, bursts, net_bursts, conditions, mins_recorded,
+                    windows,
+                    lambda s, b, nb, mins: _window_tables(
+                            s, b, nb, condition_labels, mins))
+    return tables
@@ -0,0 +1,153 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+
+from core.mea_analysis import OUTPUT_NAMES, output_names
+from core.mea_jobs import finished, report, run_quietly
+from core.mea_options import BURSTS_SUFFIX, NET_BURSTS_SUFFIX, SPIKES_SUFFIX
+from core.mea_output import output_files
+from core.mea_pipeline import plate_files, get_plate_name, run_plate
+
+
+@dataclass
+class plate_result:
+    plate_name: str
+    base: str
+    status: str             # 'ok', 'failed' or 'skipped'
+    seconds: float = 0.
+    error: Optional[str] = None
+
+
+def discover_plates(base_dir, conditions_fname='conditions.txt',
+                    spikes_suffix=SPIKES_SUFFIX, bursts_suffix=BURSTS_SUFFIX,
+                    net_bursts_suffix=NET_BURSTS_SUFFIX,
+                    need_bursts=True, report_missing=True) -> List[plate_files]:
+    """Find all complete plate triplets below base_dir.
+
+    A plate is a spikes file '<plate_name>_<spikes_suffix>' next to
+    '<plate_name>_<bursts_suffix>' and '<plate_name>_<net_bursts_suffix>'
+    (names are matched case-insensitively). The plate name is derived like in
+    a single plate run, so the spikes suffix must not contain '_'. The
+    conditions file is looked up as '<plate_name>_<conditions_fname>' and
+    then '<conditions_fname>' in the same directory. Plates with missing
+    files are skipped (and reported with report_missing). Without
+    need_bursts (bursts are detected from the spikes), the bursts and
+    network bursts files are optional.
+    """
+    if not os.path.isdir(base_dir):
+        raise FileNotFoundError(f'{base_dir} does not exist!')
+
+    plates = []
+    for root, dirs, fnames in os.walk(base_dir):
+        dirs.sort()
+        by_lower = {f.lower(): f for f in fnames}
+        for fname in sorted(fnames):
+            lower = fname.lower()
+            if not lower.endswith('_' + spikes_suffix.lower()):
+                continue
+            plate_name = get_plate_name(fname)
+
+            candidates = {
+                'bursts_file': f'{plate_name}_{bursts_suffix}',
+                'net_bursts_file': f'{plate_name}_{net_bursts_suffix}',
+            }
+            found = {k: by_lower.get(v.lower()) for k, v in candidates.items()}
+            conditions = (by_lower.get(f'{plate_name}_{conditions_fname}'.lower())
+                          or by_lower.get(conditions_fname.lower()))
+
+            if not need_bursts:
+                found = {k: found[k] or v for k, v in candidates.items()}
+            missing = [v for k, v in candidates.items() if found[k] is None]
+            if conditions is None:
+                missing.append(conditions_fname)
+            if missing:
+                if not report_missing:
+                    continue
+                print(f'Skipping {os.path.join(root, fname)}: '
+                      f'missing {", ".join(missing)}')
+                continue
+
+            plates.append(plate_files(
+                base=root,
+                plate_name=plate_name,
+                conditions_file=os.path.join(root, conditions),
+                spikes_file=os.path.join(root, fname),
+                bursts_file=os.path.join(root, found['bursts_file']),
+                net_bursts_file=os.path.join(root, found['net_bursts_file'])))
+    return plates
+
+
+def is_up_to_date(files: plate_files, output_modes=('xlsx',),
+                  names=OUTPUT_NAMES) -> bool:
+    """True if all outputs exist and are newer than every input file."""
+    outputs = output_files(files.out_base, output_modes, names)
+    if not all(os.path.isfile(f) for f in outputs):
+        return False
+    newest_input = max(os.path.getmtime(f) for f in files.inputs
+                       if os.path.exists(f))
+    return min(os.path.getmtime(f) for f in outputs) >= newest_input
+
+
+def run_plate_job(files: plate_files, mins_recorded,
+                  run_options) -> plate_result:
+    """run_plate with its output captured, e.g. in a worker process."""
+    seconds, error = run_quietly(run_plate, files, mins_recorded,
+                                 **run_options)
+    return plate_result(files.plate_name, files.base,
+                        'failed' if error else 'ok', seconds, error)
+
+
+def plate_crashed(files: plate_files, error) -> plate_result:
+    """Result of a plate whose job did not return (see mea_jobs)."""
+    return plate_result(files.plate_name, files.base, 'failed', error=error)
+
+
+def report_plate(result: plate_result):
+    report(result.status, os.path.join(result.base, result.plate_name),
+           result.seconds, result.error)
+
+
+def run_batch(plates: List[plate_files], mins_recorded, workers=None,
+              force=False, **run_options) -> List[plate_result]:
+    """Analyze many plates in a process pool.
+
+    run_options are passed on to run_plate. Plates whose outputs are up to
+    date are skipped unless force is set.
+    Every plate is reported as it finishes, a failing plate does not abort
+    the batch. With workers=1 the plates are analyzed in this process.
+    """
+    results = []
+    todo = []
+    names = output_names(run_options.get('spike_trains'),
+                         run_options.get('windows'))
+    for files in plates:
+        if not force and is_up_to_date(
+                files, run_options.get('output_modes', ('xlsx',)), names):
+            results.append(plate_result(files.plate_name, files.base,
+                                        'skipped'))
+            report_plate(results[-1])
+        else:
+            todo.append(files)
+
+    if workers == 1:
+        for files in todo:
+            results.append(run_plate_job(files, mins_recorded, run_options))
+            report_plate(results[-1])
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_plate_job, files, mins_recorded,
+                               run_options): files
+                   for files in todo}
+        for result in finished(futures, plate_crashed):
+            results.append(result)
+            report_plate(result)
+    return results
+
+
+def summarize(results: List[plate_result]) -> str:
+    counts = {s: sum(r.status == s for r in results)
+              for s in ['ok', 'skipped', 'failed']}
+    return (f"{counts['ok']} plates analyzed, {counts['skipped']} up to date, "
+            f"{counts['failed']} failed")
@@ -0,0 +1,169 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from core.mea_io import MCS_COLUMNS
+from core.mea_options import burst_detection_options
+from core.mea_profile import stage
+from core.mea_spike_trains import spike_trains
+
+
+def _runs(flags):
+    # First and last index of every run of True in flags
+    padded = np.r_[False, flags, False].astype(np.int8)
+    change = np.diff(padded)
+    return np.flatnonzero(change == 1), np.flatnonzero(change == -1) - 1
+
+
+def _merge_close(group, start, end, min_gap):
+    # Merge consecutive intervals of the same group closer than min_gap
+    merge = np.zeros(len(start), dtype=bool)
+    merge[1:] = (group[1:] == group[:-1]) & (start[1:] - end[:-1] < min_gap)
+    first = np.flatnonzero(~merge)
+    last = np.r_[first[1:], len(start)][:len(first)] - 1
+    return first, last
+
+
+def _mcs_table(kind, columns):
+    # Same columns, column order and dtypes as load_mcs_csv's tables
+    data = pd.DataFrame(columns)
+    for col, dtype in MCS_COLUMNS[kind].items():
+        if dtype != 'category':
+            data[col] = data[col].astype(dtype)
+    return data[list(MCS_COLUMNS[kind])]
+
+
+def detect_bursts(trains: spike_trains,
+                  options: Optional[burst_detection_options] = None):
+    """Bursts of every channel with the max interval method.
+
+    A burst starts with an interval of at most max_isi_start_ms and
+    continues while the intervals are at most max_isi_end_ms. Bursts less
+    than min_ibi_ms apart are merged, then bursts shorter than
+    min_duration_ms or with fewer than min_spike_count spikes are dropped.
+    All channels are processed at once on the sorted spike trains.
+    Returns a table like the MCS bursts export.
+    """
+    options = options or burst_detection_options()
+    times = trains.times
+    isi = np.diff(times)
+    # Intervals across two channels never belong to a burst
+    linked = isi <= options.max_isi_end_ms * 1e3
+    linked[trains.offsets[1:-1] - 1] = False
+
+    # Runs of linked spikes, starting at the first short enough interval
+    run_first, run_last = _runs(linked)
+    candidate = np.where(linked & (isi <= options.max_isi_start_ms * 1e3),
+                         np.arange(len(isi)), len(isi))
+    if len(run_first):
+        first_start = np.minimum.reduceat(candidate, run_first)
+    else:
+        first_start = np.zeros(0, dtype=np.int64)
+    keep = first_start <= run_last
+    # Burst spikes are link first ... link last + 1
+    first_spike = first_start[keep]
+    last_spike = run_last[keep] + 1
+
+    segment = trains.segment_ids()[first_spike]
+    first, last = _merge_close(segment, times[first_spike],
+                               times[last_spike], options.min_ibi_ms * 1e3)
+    first_spike, last_spike = first_spike[first], last_spike[last]
+    segment = segment[first]
+
+    duration = times[last_spike] - times[first_spike]
+    spike_count = last_spike - first_spike + 1
+    keep = ((duration >= options.min_duration_ms * 1e3)
+            & (spike_count >= options.min_spike_count))
+    first_spike, last_spike = first_spike[keep], last_spike[keep]
+    segment, duration, spike_count = (segment[keep], duration[keep],
+                                      spike_count[keep])
+
+    with np.errstate(divide='ignore'):
+        frequency = spike_count / (duration / 1e6)
+    bursts = _mcs_table('bursts', {
+            'Channel Label': pd.Categorical.from_codes(
+                trains.channel_codes[segment], trains.channels),
+            'Well Label': pd.Categorical.from_codes(
+                trains.well_codes[segment], trains.wells),
+            'Start timestamp [µs]': times[first_spike],
+            'Duration [µs]': duration,
+            'Spike Count': spike_count,
+            'Spike Frequency [Hz]': frequency})
+    return bursts
+
+
+def detect_network_bursts(trains: spike_trains, bursts,
+                          options: Optional[burst_detection_options] = None):
+    """Network bursts of every well from the bursts of its channels.
+
+    A sweep line over the burst starts and ends of all wells counts the
+    electrodes that burst at the same time, a network burst lasts as long
+    as at least nb_min_channels do. Network bursts less than nb_min_ibi_ms
+    apart are merged, shorter ones than nb_min_duration_ms dropped. The
+    spike count is the number of spikes of all electrodes of the well
+    within the network burst. Returns a table like the MCS network bursts
+    export.
+    """
+    options = options or burst_detection_options()
+    well = bursts['Well Label'].cat.codes.to_numpy(np.int64)
+    start = bursts['Start timestamp [µs]'].to_numpy(np.int64)
+    end = start + bursts['Duration [µs]'].to_numpy(np.int64)
+
+    # Events sorted by well and time, ends before starts at the same time
+    event_well = np.r_[well, well]
+    event_time = np.r_[start, end]
+    event_delta = np.r_[np.ones(len(start), np.int64),
+                        -np.ones(len(end), np.int64)]
+    order = np.lexsort((event_delta, event_time, event_well))
+    event_well, event_time = event_well[order], event_time[order]
+    # Every well's events add up to 0, the count does not leak between wells
+    active = np.cumsum(event_delta[order])
+
+    above = active >= max(options.nb_min_channels, 1)
+    run_first, run_last = _runs(above)
+    # A run ends with the event that takes the count below the threshold
+    nb_well = event_well[run_first]
+    nb_start = event_time[run_first]
+    nb_end = event_time[run_last + 1] if len(run_last) else nb_start
+
+    first, last = _merge_close(nb_well, nb_start, nb_end,
+                               options.nb_min_ibi_ms * 1e3)
+    nb_well, nb_start, nb_end = nb_well[first], nb_start[first], nb_end[last]
+    keep = nb_end - nb_start >= options.nb_min_duration_ms * 1e3
+    nb_well, nb_start, nb_end = nb_well[keep], nb_start[keep], nb_end[keep]
+
+    # Spikes per well sorted by time, counted with one searchsorted
+    spike_well = np.repeat(trains.well_codes, np.diff(trains.offsets))
+    span = int(trains.times.max()) + 1 if len(trains.times) else 1
+    well_times = np.sort(spike_well * span + trains.times)
+    spike_count = (np.searchsorted(well_times, nb_well * span + nb_end,
+                                   'right')
+                   - np.searchsorted(well_times, nb_well * span + nb_start,
+                                     'left'))
+    duration = nb_end - nb_start
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frequency = spike_count / (duration / 1e6)
+
+    return _mcs_table('net_bursts', {
+            'Well Label': pd.Categorical.from_codes(nb_well, trains.wells),
+            'Start timestamp [µs]': nb_start,
+            'Duration [µs]': duration,
+            'Spike Count': spike_count,
+            'Spike Frequency [Hz]': frequency})
+
+
+def detect_all(spikes, options: Optional[burst_detection_options] = None):
+    """Bursts and network bursts tables detected in a spikes table.
+
+    spikes needs the 'Timestamp [µs]' column. The tables have the schema
+    of the MCS exports (as loaded by core.mea_io.load_mcs_csv), so they can
+    be analyzed in place of the exported ones.
+    """
+    with stage('sort'):
+        trains = spike_trains(spikes)
+    with stage('bursts'):
+        bursts = detect_bursts(trains, options)
+    with stage('net_bursts'):
+        net_bursts = detect_network_bursts(trains, bursts, options)
+    return bursts, net_bursts
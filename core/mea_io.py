@@ -0,0 +1,202 @@
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+    from pyarrow import feather
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Columns (and their dtypes) that are used from the MCS exports. Everything
+# else (compound/dose/experiment info, amplitudes, ...) is never parsed.
+MCS_COLUMNS: Dict[str, Dict[str, str]] = {
+    'spikes': {'Channel Label': 'category',
+               'Well Label': 'category'},
+    'bursts': {'Channel Label': 'category',
+               'Well Label': 'category',
+               'Start timestamp [µs]': 'int64',
+               'Duration [µs]': 'int64',
+               'Spike Count': 'int64',
+               'Spike Frequency [Hz]': 'float64'},
+    'net_bursts': {'Well Label': 'category',
+                   'Start timestamp [µs]': 'int64',
+                   'Duration [µs]': 'int64',
+                   'Spike Count': 'int64',
+                   'Spike Frequency [Hz]': 'float64'},
+}
+
+# Files larger than this are read in chunks of CHUNK_ROWS rows, so that only
+# the compact (categorical/integer) result has to fit into memory and not the
+# intermediate python strings of the whole file.
+CHUNKED_READ_BYTES = 1024 ** 3
+CHUNK_ROWS = 2_000_000
+
+# Bump when the parsed tables change, so that cached tables are not reused
+CACHE_VERSION = 1
+
+
+def load_mcs_csv(filename, kind, extra_columns: Optional[Dict[str, str]] = None,
+                 engine='auto', chunksize=None):
+    """Read the columns of an MCS export that are needed for the analysis.
+
+    kind is one of MCS_COLUMNS' keys. Only these columns (plus
+    extra_columns, a dict of column -> dtype) are parsed, with label columns
+    as categoricals and time stamps as int64. engine is 'pyarrow' (the
+    pyarrow csv reader), a pandas read_csv engine or 'auto' (pyarrow if
+    installed, else 'c'). With a chunksize, or for files larger than
+    CHUNKED_READ_BYTES, the file is read in chunks of that many rows with the
+    'c' engine.
+    """
+    dtypes = dict(MCS_COLUMNS[kind])
+    if extra_columns:
+        dtypes.update(extra_columns)
+
+    if chunksize is None and os.path.getsize(filename) > CHUNKED_READ_BYTES:
+        chunksize = CHUNK_ROWS
+    if engine == 'auto':
+        engine = 'pyarrow' if HAS_PYARROW else 'c'
+
+    if chunksize is not None:
+        reader = pd.read_csv(filename, usecols=list(dtypes), dtype=dtypes,
+                             engine='c', chunksize=chunksize)
+        with reader:
+            chunks = list(reader)
+        if chunks:
+            data = _concat_chunks(chunks, dtypes)
+        else:
+            data = pd.read_csv(filename, usecols=list(dtypes), dtype=dtypes,
+                               nrows=0)
+    elif engine == 'pyarrow':
+        data = _read_pyarrow(filename, dtypes)
+    else:
+        data = pd.read_csv(filename, usecols=list(dtypes), dtype=dtypes,
+                           engine=engine)
+
+    # usecols does not keep the column order, and engines differ in it
+    if list(data.columns) != list(dtypes):
+        data = data[list(dtypes)]
+    for col, dtype in dtypes.items():
+        if dtype == 'category':
+            data[col] = _normalize_categories(data[col])
+    return data
+
+
+def _read_pyarrow(filename, dtypes):
+    # pandas' pyarrow engine parses all columns and converts afterwards, the
+    # pyarrow reader itself skips unused columns and dictionary encodes the
+    # labels while parsing.
+    arrow_types = {'category': pa.dictionary(pa.int32(), pa.string()),
+                   'int64': pa.int64(),
+                   'float64': pa.float64()}
+    options = pa_csv.ConvertOptions(
+            include_columns=list(dtypes),
+            column_types={col: arrow_types[dtype]
+                          for col, dtype in dtypes.items()})
+    return pa_csv.read_csv(filename, convert_options=options).to_pandas()
+
+
+def count_spikes_chunked(filename, chunksize=CHUNK_ROWS):
+    """Spike counts per channel and well, read in bounded-size chunks.
+
+    Only chunksize rows of the spikes export are in memory at a time, each
+    chunk's counts are added to a running Channel x Well count table. Returns
+    one row per Channel Label/Well Label pair with its 'Spike Count', which
+    the analysis accepts in place of the full spikes table.
+    """
+    dtypes = MCS_COLUMNS['spikes']
+    label_cols = list(dtypes)
+
+    totals = None
+    reader = pd.read_csv(filename, usecols=label_cols, dtype=dtypes,
+                         engine='c', chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            counts = (chunk.groupby(label_cols, observed=True).size()
+                      .rename('Spike Count').reset_index())
+            # Chunks have different categories, add up on the plain labels
+            for col in label_cols:
+                counts[col] = counts[col].astype(str)
+            if totals is not None:
+                counts = (pd.concat([totals, counts])
+                          .groupby(label_cols, as_index=False, sort=False)
+                          ['Spike Count'].sum())
+            totals = counts
+
+    if totals is None:
+        totals = pd.DataFrame({col: pd.Series(dtype=str) for col in label_cols})
+        totals['Spike Count'] = pd.Series(dtype='int64')
+    for col in label_cols:
+        totals[col] = _normalize_categories(totals[col].astype('category'))
+    return totals.reset_index(drop=True)
+
+
+def _concat_chunks(chunks, dtypes):
+    # Every chunk has its own categories, pd.concat would fall back to object
+    # columns, hence the columns are combined one by one.
+    if len(chunks) == 1:
+        return chunks[0]
+    data = dict()
+    for col in chunks[0].columns:
+        if dtypes[col] == 'category':
+            data[col] = union_categoricals([c[col] for c in chunks],
+                                           sort_categories=True)
+        else:
+            data[col] = np.concatenate([c[col].to_numpy() for c in chunks])
+    return pd.DataFrame(data)
+
+
+def _normalize_categories(series):
+    # read_csv always parses categories as strings. Labels that are numbers
+    # (e.g. channel labels like 12) are converted back, and categories are
+    # sorted, so that groups are ordered and written like with a plain
+    # read_csv.
+    categories = series.cat.categories
+    if len(categories) == 0:
+        return series
+    try:
+        categories = pd.Index(pd.to_numeric(
+                np.asarray(categories, dtype=object)))
+        series = series.cat.rename_categories(categories)
+    except (ValueError, TypeError):
+        pass
+    if not categories.is_monotonic_increasing:
+        series = series.cat.reorder_categories(categories.sort_values())
+    return series
+
+
+def cached_table(cache, filename, variant, load):
+    """Load a table derived from filename through a core.file_cache.
+
+    On a miss, load() parses the table and it is stored as uncompressed
+    Feather, later runs memory map that file instead of parsing filename
+    again. variant names what load() derives from the file. Without a cache
+    (cache is None) or without pyarrow this is just load().
+    """
+    if cache is None or not HAS_PYARROW:
+        return load()
+
+    key = cache.key(filename, f'v{CACHE_VERSION}:{variant}')
+    path = cache.get(key, 'feather')
+    if path is not None:
+        print(f'Using cached {os.path.basename(filename)}')
+        return feather.read_table(path, memory_map=True).to_pandas()
+
+    data = load()
+    cache.put(key, 'feather',
+              lambda tmp: feather.write_feather(data, tmp,
+                                                compression='uncompressed'))
+    return data
+
+
+def table_variant(kind, extra_columns: Optional[Dict[str, str]] = None):
+    """Cache variant of the table load_mcs_csv parses for kind."""
+    dtypes = dict(MCS_COLUMNS[kind])
+    if extra_columns:
+        dtypes.update(extra_columns)
+    return f'{kind}:' + ','.join(f'{k}={v}' for k, v in dtypes.items())
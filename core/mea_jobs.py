@@ -0,0 +1,45 @@
+import contextlib
+import io
+import time
+import traceback
+from concurrent.futures import as_completed
+
+
+def run_quietly(function, *args, **kwargs):
+    """Call function with its console output captured.
+
+    For jobs in worker processes, whose per-plate chatter would interleave.
+    Returns the seconds it took and the traceback if it raised, else None.
+    """
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(*args, **kwargs)
+    except Exception:
+        return time.perf_counter() - start, traceback.format_exc()
+    return time.perf_counter() - start, None
+
+
+def result_of(future, job, crashed):
+    """Result of a finished future, crashed(job, traceback) if it raised."""
+    try:
+        return future.result()
+    except Exception:
+        # e.g. a worker process that died
+        return crashed(job, traceback.format_exc())
+
+
+def finished(futures, crashed):
+    """Results of futures (a dict future -> job) as they finish."""
+    for future in as_completed(futures):
+        yield result_of(future, futures[future], crashed)
+
+
+def report(status, where, seconds=0., error=None):
+    """Print one line per finished job, failed ones with their traceback."""
+    if status == 'ok':
+        print(f'[ok]      {where} ({seconds:.1f} s)')
+    elif status == 'skipped':
+        print(f'[skipped] {where} (outputs up to date)')
+    else:
+        print(f'[failed]  {where}\n{error}')
@@ -0,0 +1,48 @@
+"""Options and names the command line needs, without NumPy/pandas.
+
+mea_cli builds its arguments from these, so that parsing arguments (and
+--help) does not import the analysis. The analysis modules re-export them.
+"""
+from dataclasses import dataclass
+
+# File name suffixes of the MCS exports of a plate (see core.mea_batch)
+SPIKES_SUFFIX = 'spikes.csv'
+BURSTS_SUFFIX = 'bursts.csv'
+NET_BURSTS_SUFFIX = 'net_bursts.csv'
+
+# Output modes of core.mea_output.OUTPUT_WRITERS
+OUTPUT_MODES = ['xlsx', 'workbook', 'csv', 'parquet', 'xlsx-parallel']
+
+
+@dataclass
+class spike_train_options:
+    # Bin width of the firing rate time courses
+    rate_bin_s: float = 10.
+    # Bin width of the spike counts that are correlated for the synchrony
+    sync_bin_ms: float = 10.
+    isi_bins_per_decade: int = 10
+
+
+@dataclass
+class burst_detection_options:
+    # Max interval method, the defaults are those of the MCS software
+    max_isi_start_ms: float = 50.
+    max_isi_end_ms: float = 50.
+    min_ibi_ms: float = 100.
+    min_duration_ms: float = 50.
+    min_spike_count: int = 5
+    # A network burst is a period in which at least this many electrodes of
+    # a well burst at the same time
+    nb_min_channels: int = 3
+    nb_min_ibi_ms: float = 100.
+    nb_min_duration_ms: float = 50.
+
+
+@dataclass
+class window_options:
+    window_s: float = 60.
+    # Windows overlap if the step is shorter than the window
+    step_s: float = 30.
+    # 'start': bursts belong to the windows their start falls into,
+    # 'overlap': to every window they overlap
+    assign: str = 'start'
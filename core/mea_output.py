@@ -0,0 +1,128 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from core.mea_analysis import OUTPUT_NAMES
+from core.mea_profile import stage
+from core.mea_windows import WINDOWED_OUTPUT_NAME
+
+try:
+    import xlsxwriter  # noqa: F401
+    FAST_XLSX_ENGINE = 'xlsxwriter'
+except ImportError:
+    FAST_XLSX_ENGINE = None
+
+WORKBOOK_NAME = 'results.xlsx'
+
+# Long tables that outgrow excel's 1,048,576 rows per sheet (windowed metrics
+# of long recordings in short windows), the excel modes write them as csv
+CSV_ONLY_NAMES = {WINDOWED_OUTPUT_NAME}
+
+
+@dataclass
+class output_writer:
+    # write(tables, out_base) writes all tables (name -> DataFrame/Series)
+    write: Callable
+    # files(out_base, names) lists the files write creates for these tables
+    files: Callable[[str, List[str]], List[str]]
+
+
+def _per_table_files(ext):
+    return lambda out_base, names: [os.path.join(out_base, f'{name}.{ext}')
+                                    for name in names]
+
+
+def _excel_files(files):
+    # files of an excel mode plus the csv files of the CSV_ONLY_NAMES
+    return lambda out_base, names: (
+            files(out_base, [n for n in names if n not in CSV_ONLY_NAMES])
+            + _per_table_files('csv')(
+                    out_base, [n for n in names if n in CSV_ONLY_NAMES]))
+
+
+def _excel_tables(tables, out_base):
+    # Writes the CSV_ONLY_NAMES tables as csv, returns the others
+    write_csv({name: table for name, table in tables.items()
+               if name in CSV_ONLY_NAMES}, out_base)
+    return {name: table for name, table in tables.items()
+            if name not in CSV_ONLY_NAMES}
+
+
+def write_xlsx(tables, out_base):
+    """One xlsx file per table (the original layout)."""
+    for name, table in _excel_tables(tables, out_base).items():
+        table.to_excel(os.path.join(out_base, f'{name}.xlsx'))
+
+
+def write_workbook(tables, out_base):
+    """All tables as sheets of one workbook."""
+    with pd.ExcelWriter(os.path.join(out_base, WORKBOOK_NAME),
+                        engine=FAST_XLSX_ENGINE) as writer:
+        for name, table in _excel_tables(tables, out_base).items():
+            # Output names are short enough for excel's 31 character limit
+            table.to_excel(writer, sheet_name=name)
+
+
+def write_csv(tables, out_base):
+    for name, table in tables.items():
+        table.to_csv(os.path.join(out_base, f'{name}.csv'))
+
+
+def write_parquet(tables, out_base):
+    # Network burst tables are Series, parquet needs a frame
+    for name, table in tables.items():
+        if table.ndim == 1:
+            table = table.to_frame()
+        table.to_parquet(os.path.join(out_base, f'{name}.parquet'))
+
+
+def _write_one_xlsx(name, table, out_base):
+    table.to_excel(os.path.join(out_base, f'{name}.xlsx'),
+                   engine=FAST_XLSX_ENGINE)
+
+
+def write_xlsx_parallel(tables, out_base, workers=None):
+    """One xlsx file per table, written by a pool of processes."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_write_one_xlsx, name, table, out_base)
+                   for name, table in _excel_tables(tables, out_base).items()]
+        for future in futures:
+            future.result()
+
+
+OUTPUT_WRITERS: Dict[str, output_writer] = {
+    'xlsx': output_writer(write_xlsx, _excel_files(_per_table_files('xlsx'))),
+    'workbook': output_writer(
+        write_workbook,
+        _excel_files(
+            lambda out_base, names: [os.path.join(out_base, WORKBOOK_NAME)])),
+    'csv': output_writer(write_csv, _per_table_files('csv')),
+    'parquet': output_writer(write_parquet, _per_table_files('parquet')),
+    'xlsx-parallel': output_writer(write_xlsx_parallel,
+                                   _excel_files(_per_table_files('xlsx'))),
+}
+
+
+def register_writer(mode, writer: output_writer):
+    """Make an additional output mode available."""
+    OUTPUT_WRITERS[mode] = writer
+
+
+def write_tables(tables, out_base, modes=('xlsx',)):
+    """Write every table to out_base in each of the given output modes."""
+    if not os.path.exists(out_base):
+        os.makedirs(out_base)
+    for mode in modes:
+        with stage(mode):
+            OUTPUT_WRITERS[mode].write(tables, out_base)
+
+
+def output_files(out_base, modes=('xlsx',), names=OUTPUT_NAMES):
+    """Files written by write_tables for the given output modes."""
+    files = []
+    for mode in modes:
+        files += OUTPUT_WRITERS[mode].files(out_base, names)
+    return files
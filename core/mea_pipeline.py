@@ -0,0 +1,203 @@
+import os
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from core.file_cache import DEFAULT_CACHE_BYTES, file_cache
+from core.mea_analysis import analyze, read_conditions
+from core.mea_burst_detection import burst_detection_options, detect_all
+from core.mea_io import (CHUNK_ROWS, cached_table, count_spikes_chunked,
+                         load_mcs_csv, table_variant)
+from core.mea_output import write_tables
+from core.mea_profile import (PROFILE_NAME, print_profile, profiling_mode,
+                              stage)
+from core.mea_spike_trains import (BINNED_OUTPUT_NAMES, SPIKE_TRAIN_COLUMNS,
+                                   spike_train_options)
+from core.mea_store import add_plate, recording_date
+from core.mea_windows import WINDOWED_OUTPUT_NAME, window_options
+
+
+@dataclass
+class plate_files:
+    base: str
+    plate_name: str
+
+    conditions_file: str
+    spikes_file: str
+    bursts_file: str
+    net_bursts_file: str
+
+    @property
+    def out_base(self):
+        return os.path.join(self.base, self.plate_name)
+
+    @property
+    def inputs(self):
+        return [self.conditions_file, self.spikes_file, self.bursts_file,
+                self.net_bursts_file]
+
+
+def get_plate_name(spikes_file: str) -> str:
+    """Plate name, i.e. the spikes file name without its last '_' part."""
+    return '_'.join(os.path.basename(spikes_file).split('_')[0:-1])
+
+
+def get_plate_files(base, conditions_fname, spikes_fname, bursts_fname,
+                    net_bursts_fname, need_bursts=True) -> plate_files:
+    """Resolve and check the input files of one plate in base.
+
+    Without need_bursts (bursts are detected from the spikes), the bursts
+    and network bursts files do not have to exist.
+    """
+    if not os.path.exists(base):
+        raise FileNotFoundError(f'{base} does not exist!')
+
+    files = plate_files(
+            base=base,
+            plate_name=get_plate_name(spikes_fname),
+            conditions_file=os.path.join(base, conditions_fname),
+            spikes_file=os.path.join(base, spikes_fname),
+            bursts_file=os.path.join(base, bursts_fname),
+            net_bursts_file=os.path.join(base, net_bursts_fname))
+
+    required = (files.inputs if need_bursts
+                else [files.conditions_file, files.spikes_file])
+    for fname in required:
+        if not os.path.isfile(fname):
+            raise FileNotFoundError(f"{fname} not found or not a file!")
+
+    return files
+
+
+def load_plate(files: plate_files, stream_spikes=False, chunksize=None,
+               cache: Optional[file_cache] = None, spike_times=False,
+               load_bursts=True):
+    """Load the spikes, bursts and network bursts tables of a plate.
+
+    With stream_spikes, the spikes export is only counted per channel and
+    well in chunks of chunksize rows instead of being loaded as a whole.
+    Parsed tables are taken from / stored in cache if one is given. With
+    spike_times, the spikes table also gets the spike time stamps. Without
+    load_bursts, only the spikes are loaded (bursts and network bursts are
+    None).
+    """
+    if stream_spikes and spike_times:
+        raise ValueError('Spike time stamps cannot be streamed, they are '
+                         'only counted')
+    spikes_columns = SPIKE_TRAIN_COLUMNS if spike_times else None
+    with stage('spikes'):
+        if stream_spikes:
+            spikes = cached_table(
+                    cache, files.spikes_file, 'spike_counts',
+                    lambda: count_spikes_chunked(
+                            files.spikes_file,
+                            chunksize=chunksize or CHUNK_ROWS))
+        else:
+            spikes = cached_table(
+                    cache, files.spikes_file,
+                    table_variant('spikes', spikes_columns),
+                    lambda: load_mcs_csv(files.spikes_file, 'spikes',
+                                         extra_columns=spikes_columns,
+                                         chunksize=chunksize))
+    if not load_bursts:
+        print('Data loaded')
+        return spikes, None, None
+    with stage('bursts'):
+        bursts = cached_table(
+                cache, files.bursts_file, table_variant('bursts'),
+                lambda: load_mcs_csv(files.bursts_file, 'bursts'))
+    with stage('net_bursts'):
+        net_bursts = cached_table(
+                cache, files.net_bursts_file, table_variant('net_bursts'),
+                lambda: load_mcs_csv(files.net_bursts_file, 'net_bursts'))
+    print('Data loaded')
+    return spikes, bursts, net_bursts
+
+
+def run_plate(files: plate_files, mins_recorded, stream_spikes=False,
+              chunksize=None, cache_dir=None, cache_size=DEFAULT_CACHE_BYTES,
+              output_modes=('xlsx',), store_dir=None,
+              spike_trains: Optional[spike_train_options] = None,
+              burst_detection: Optional[burst_detection_options] = None,
+              windows: Optional[window_options] = None, profile=None,
+              date=None):
+    """Load, analyze and write the results of one plate.
+
+    stream_spikes and chunksize are passed on to load_plate. Parsed tables
+    are cached in cache_dir (at most cache_size bytes), None disables the
+    cache. The results are written in every mode of output_modes (see
+    core.mea_output.OUTPUT_WRITERS). With a store_dir, the results are
+    also added to that metrics store (see core.mea_store), with the
+    recording date (by default from the plate's file name or
+    modification time, see core.mea_store.recording_date). With
+    spike_trains options, the spike train metrics are computed as well.
+    With burst_detection options, bursts and network bursts are detected in
+    the spikes (see core.mea_burst_detection) instead of being read from
+    the exported files. With windows options, the metrics are also
+    computed per time window (see core.mea_windows). With a profile mode
+    ('time' or 'memory'), the wall time (and peak memory) of every stage
+    is written to <output folder>/profile.json (see core.mea_profile).
+    """
+    cache = file_cache(cache_dir, cache_size) if cache_dir else None
+    print(f'Plate name is {files.plate_name} in {files.base}')
+    print(f'Output folder is {files.out_base}')
+
+    with profiling_mode(profile) as profiler:
+        conditions = read_conditions(files.conditions_file)
+        detect = burst_detection is not None
+        with stage('load'):
+            spikes, bursts, net_bursts = load_plate(
+                    files, stream_spikes=stream_spikes, chunksize=chunksize,
+                    cache=cache,
+                    spike_times=(spike_trains is not None or detect
+                                 or windows is not None),
+                    load_bursts=not detect)
+        rows = {'spikes': len(spikes)}
+        if detect:
+            with stage('detect_bursts'):
+                bursts, net_bursts = detect_all(spikes, burst_detection)
+            print(f'Detected {len(bursts)} bursts and {len(net_bursts)} '
+                  'network bursts')
+        rows.update(bursts=len(bursts), net_bursts=len(net_bursts))
+
+        with stage('analyze'):
+            tables = analyze(spikes, bursts, net_bursts, conditions,
+                             mins_recorded, spike_trains=spike_trains,
+                             windows=windows)
+        with stage('write'):
+            write_tables(tables, files.out_base, modes=output_modes)
+        if store_dir:
+            with stage('store'):
+                # The store holds values per channel/well, not binned time
+                # courses
+                store_tables = {name: table for name, table in tables.items()
+                                if name not in BINNED_OUTPUT_NAMES
+                                and name != WINDOWED_OUTPUT_NAME}
+                add_plate(store_dir, store_tables, conditions,
+                          files.plate_name, files.base,
+                          recording_date(files.spikes_file, date))
+            print(f'Results added to {store_dir}')
+
+        if profile:
+            profile_file = os.path.join(files.out_base, PROFILE_NAME)
+            report = profiler.write(
+                    profile_file, plate=files.plate_name,
+                    inputs=_input_sizes(files), rows=rows,
+                    wells=spikes['Well Label'].nunique(),
+                    options=dict(
+                        mins_recorded=mins_recorded,
+                        stream_spikes=stream_spikes, chunksize=chunksize,
+                        cache=cache is not None,
+                        output_modes=list(output_modes),
+                        spike_trains=spike_trains and asdict(spike_trains),
+                        burst_detection=(burst_detection
+                                         and asdict(burst_detection)),
+                        windows=windows and asdict(windows)))
+            print_profile(report)
+            print(f'Profile written to {profile_file}')
+    return tables
+
+
+def _input_sizes(files: plate_files):
+    # Input file name -> size in bytes, for scaling curves
+    return {os.path.basename(f): os.path.getsize(f) for f in files.inputs
+            if os.path.isfile(f)}
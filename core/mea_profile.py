@@ -0,0 +1,167 @@
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+PROFILE_NAME = 'profile.json'
+PROFILE_VERSION = 1
+
+
+@dataclass
+class stage_record:
+    # Nested stages are named '<outer>/<inner>'
+    name: str
+    calls: int = 0
+    seconds: float = 0.
+    # Highest traced (Python and NumPy) memory in use during the stage
+    peak_bytes: int = 0
+    # ... above the memory that was in use when the stage started
+    added_bytes: int = 0
+    # High-water mark of the process' resident memory when the stage ended
+    max_rss_bytes: int = 0
+
+
+def max_rss_bytes():
+    """Peak resident memory of this process so far, 0 if unknown."""
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class stage_profiler():
+    """Wall time and peak memory of named, possibly nested, stages.
+
+    Memory is measured with tracemalloc, which sees the Python objects and
+    NumPy/pandas data but not memory allocated by pyarrow or other
+    libraries, and slows allocation heavy code down somewhat. Repeated
+    stages (e.g. one per output mode) are summed up, their peak is the
+    highest of all calls.
+    """
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.records = dict()
+        # Open stages: [record, start time, traced memory at start, peak]
+        self._open = []
+        self._started = time.perf_counter()
+
+    def _fold_peak(self):
+        # tracemalloc has one peak, keep it per open stage before resetting
+        if not self.trace_memory:
+            return 0
+        current, peak = tracemalloc.get_traced_memory()
+        for entry in self._open:
+            entry[3] = max(entry[3], peak)
+        tracemalloc.reset_peak()
+        return current
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self._open:
+            name = f'{self._open[-1][0].name}/{name}'
+        record = self.records.setdefault(name, stage_record(name))
+        current = self._fold_peak()
+        entry = [record, time.perf_counter(), current, current]
+        self._open.append(entry)
+        try:
+            yield record
+        finally:
+            self._fold_peak()
+            self._open.remove(entry)
+            record.calls += 1
+            record.seconds += time.perf_counter() - entry[1]
+            record.peak_bytes = max(record.peak_bytes, entry[3])
+            record.added_bytes = max(record.added_bytes, entry[3] - entry[2])
+            record.max_rss_bytes = max_rss_bytes()
+
+    def report(self, **info):
+        """The stages and info (e.g. the plate and options) as a dict."""
+        return {'version': PROFILE_VERSION,
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                **info,
+                'total_seconds': time.perf_counter() - self._started,
+                'max_rss_bytes': max_rss_bytes(),
+                'memory_traced': self.trace_memory,
+                'stages': [asdict(r) for r in self.records.values()]}
+
+    def write(self, filename, **info):
+        """Write the report as JSON, returns it."""
+        report = self.report(**info)
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        return report
+
+
+# The profiler of the running profiling() block, stage() is a no-op without
+_ACTIVE = None
+
+
+@contextlib.contextmanager
+def profiling(trace_memory=True):
+    """Record every stage() entered within this block.
+
+    Yields the stage_profiler. Memory is traced from the start of the block
+    unless trace_memory is False.
+    """
+    global _ACTIVE
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    previous, _ACTIVE = _ACTIVE, stage_profiler(trace_memory)
+    try:
+        yield _ACTIVE
+    finally:
+        _ACTIVE = previous
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def profiling_mode(mode):
+    """profiling() for a profile mode, a no-op block for None.
+
+    Mode 'time' (or True) only records wall times, 'memory' also traces the
+    memory, which slows allocation heavy stages down.
+    """
+    if not mode:
+        return contextlib.nullcontext()
+    return profiling(trace_memory=mode == 'memory')
+
+
+def stage(name):
+    """Context manager that times the enclosed code as stage name.
+
+    Only recorded within a profiling() block, costs nothing otherwise.
+    """
+    if _ACTIVE is None:
+        return contextlib.nullcontext()
+    return _ACTIVE.stage(name)
+
+
+def print_profile(report):
+    """Print the stages of a report as a table."""
+    memory = report['memory_traced']
+    print(f"{'stage':<40} {'calls':>5} {'seconds':>9}"
+          + (f" {'peak MiB':>9} {'added MiB':>9}" if memory else '')
+          + f" {'RSS MiB':>9}")
+    for s in report['stages']:
+        print(f"{s['name']:<40} {s['calls']:>5} {s['seconds']:>9.3f}"
+              + (f" {s['peak_bytes'] / 2 ** 20:>9.1f}"
+                 f" {s['added_bytes'] / 2 ** 20:>9.1f}" if memory else '')
+              + f" {s['max_rss_bytes'] / 2 ** 20:>9.0f}")
+    print(f"total {report['total_seconds']:.2f} s, max RSS "
+          f"{report['max_rss_bytes'] / 2 ** 20:.0f} MiB")
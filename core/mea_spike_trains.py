@@ -0,0 +1,244 @@
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from core.mea_options import spike_train_options
+from core.mea_profile import stage
+
+TIMESTAMP_COL = 'Timestamp [µs]'
+
+# Additional spikes columns (and dtypes) the spike train metrics need, see
+# core.mea_io.load_mcs_csv's extra_columns
+SPIKE_TRAIN_COLUMNS = {TIMESTAMP_COL: 'int64'}
+
+SPIKE_TRAIN_OUTPUT_NAMES = ['isi_mean', 'isi_cv', 'isi_histogram',
+                            'firing_rate', 'synchrony_index']
+
+# Tables indexed by time or ISI bins instead of channels
+BINNED_OUTPUT_NAMES = ['isi_histogram', 'firing_rate']
+
+# Log ISI histogram range, 0.1 ms to 100 s
+ISI_MIN_US = 1e2
+ISI_MAX_US = 1e8
+
+
+def _codes(labels):
+    # Category codes and categories of a (categorical) label column
+    if not isinstance(labels.dtype, pd.CategoricalDtype):
+        labels = labels.astype('category')
+    return labels.cat.codes.to_numpy(np.int64), labels.cat.categories
+
+
+def _sort_by_group_and_time(group, times):
+    # Sorting one combined int64 key is several times faster than lexsort
+    first = times.min()
+    span = int(times.max()) - int(first) + 1
+    if (int(group.max()) + 1) * span < np.iinfo(np.int64).max:
+        key = np.sort(group * span + (times - first))
+        return key // span, key % span + first
+    order = np.lexsort((times, group))
+    return group[order], times[order]
+
+
+class spike_trains():
+    """Spike time stamps of a plate sorted once by well, channel and time.
+
+    The spikes of each well/channel pair form one contiguous segment of
+    times, offsets[i]:offsets[i + 1] is segment i with well
+    well_codes[i] and channel channel_codes[i]. All metrics work on these
+    arrays with NumPy, without a Python loop over channels.
+    """
+    def __init__(self, spikes):
+        well, self.wells = _codes(spikes['Well Label'])
+        channel, self.channels = _codes(spikes['Channel Label'])
+        times = spikes[TIMESTAMP_COL].to_numpy(np.int64)
+
+        valid = (well >= 0) & (channel >= 0)
+        if not valid.all():
+            well, channel, times = well[valid], channel[valid], times[valid]
+
+        group = well * len(self.channels) + channel
+        # MCS exports are usually sorted already, which saves the sort
+        step = np.diff(group)
+        if not (np.all(step >= 0)
+                and np.all((np.diff(times) >= 0) | (step != 0))):
+            group, times = _sort_by_group_and_time(group, times)
+
+        boundary = np.ones(len(group), dtype=bool)
+        boundary[1:] = group[1:] != group[:-1]
+        starts = np.flatnonzero(boundary)
+        self.times = times
+        self.offsets = np.r_[starts, len(times)]
+        self.well_codes = group[starts] // len(self.channels)
+        self.channel_codes = group[starts] % len(self.channels)
+
+    @property
+    def segment_count(self):
+        return len(self.offsets) - 1
+
+    def segment_ids(self):
+        """Segment of every spike."""
+        return np.repeat(np.arange(self.segment_count),
+                         np.diff(self.offsets))
+
+    def intervals(self):
+        """Inter spike intervals [µs] and their segments.
+
+        The first spike of a segment has no interval.
+        """
+        isi = np.diff(self.times)
+        segment = self.segment_ids()[1:]
+        same = np.ones(len(isi), dtype=bool)
+        same[self.offsets[1:-1] - 1] = False
+        return isi[same], segment[same]
+
+    def per_segment(self, values, name, condition_labels):
+        """Channel (rows) x well (columns) table of one value per segment."""
+        index = pd.MultiIndex.from_arrays(
+                [self.channels[self.channel_codes],
+                 self.wells[self.well_codes]],
+                names=['Channel Label', 'Well Label'])
+        table = (pd.Series(values, index=index).unstack()
+                 .reindex(columns=condition_labels))
+        table.index = table.index.set_names(name)
+        return table
+
+
+def isi_tables(trains: spike_trains, condition_labels):
+    """Mean and coefficient of variation of the ISIs per channel and well."""
+    isi, segment = trains.intervals()
+    count = np.bincount(segment, minlength=trains.segment_count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (np.bincount(segment, isi, minlength=trains.segment_count)
+                / count)
+        # Two passes, squared time stamps in µs would lose the precision
+        deviation = isi - mean[segment]
+        std = np.sqrt(np.bincount(segment, deviation ** 2,
+                                  minlength=trains.segment_count)
+                      / (count - 1))
+        cv = std / mean
+    mean[count < 1] = np.nan
+    cv[count < 2] = np.nan
+
+    return {'isi_mean': trains.per_segment(
+                mean, "Mean Inter-Spike Interval [µs] per Well and Channel",
+                condition_labels),
+            'isi_cv': trains.per_segment(
+                cv, "Inter-Spike Interval Coefficient of Variation per Well "
+                    "and Channel", condition_labels)}
+
+
+def isi_histogram(trains: spike_trains, condition_labels,
+                  bins_per_decade=10):
+    """ISI counts per well in logarithmic bins (rows) from 0.1 ms to 100 s.
+
+    Shorter and longer intervals are counted in the first and last bin.
+    """
+    isi, segment = trains.intervals()
+    bin_count = int(np.log10(ISI_MAX_US / ISI_MIN_US) * bins_per_decade)
+    with np.errstate(divide='ignore'):
+        bins = np.floor((np.log10(isi) - np.log10(ISI_MIN_US))
+                        * bins_per_decade)
+    bins = np.clip(bins, 0, bin_count - 1).astype(np.int64)
+    well = trains.well_codes[segment]
+    counts = np.bincount(well * bin_count + bins,
+                         minlength=len(trains.wells) * bin_count)
+
+    edges_ms = ISI_MIN_US * 10 ** (np.arange(bin_count) / bins_per_decade) / 1e3
+    table = (pd.DataFrame(counts.reshape(len(trains.wells), bin_count).T,
+                          index=pd.Index(edges_ms), columns=trains.wells)
+             .reindex(columns=condition_labels, fill_value=0))
+    table.index = table.index.set_names("ISI Count per Well and ISI bin "
+                                        "(lower edge [ms])")
+    return table
+
+
+def _time_bins(times, bin_us, mins_recorded):
+    bins = times // bin_us
+    bin_count = max(int(np.ceil(mins_recorded * 60e6 / bin_us)),
+                    int(bins.max()) + 1 if len(bins) else 0)
+    return bins, bin_count
+
+
+def firing_rate(trains: spike_trains, condition_labels, mins_recorded,
+                bin_s=10.):
+    """Firing rate [Hz] of every well (columns) in time bins of bin_s."""
+    bin_us = int(bin_s * 1e6)
+    bins, bin_count = _time_bins(trains.times, bin_us, mins_recorded)
+    well = np.repeat(trains.well_codes, np.diff(trains.offsets))
+    counts = np.bincount(well * bin_count + bins,
+                         minlength=len(trains.wells) * bin_count)
+
+    table = (pd.DataFrame(counts.reshape(len(trains.wells), bin_count).T
+                          / bin_s,
+                          index=pd.Index(np.arange(bin_count) * bin_s),
+                          columns=trains.wells)
+             .reindex(columns=condition_labels, fill_value=0))
+    table.index = table.index.set_names(f"Firing Rate [Hz] per Well and "
+                                        f"{bin_s:g} s bin (start [s])")
+    return table
+
+
+def synchrony_index(trains: spike_trains, condition_labels, mins_recorded,
+                    bin_ms=10.):
+    """Synchrony of the electrodes of every well.
+
+    The mean correlation coefficient of the spike counts (in bins of
+    bin_ms) of all pairs of active electrodes of a well, NaN for wells with
+    fewer than two active electrodes.
+    """
+    bin_us = int(bin_ms * 1e3)
+    bins, bin_count = _time_bins(trains.times, bin_us, mins_recorded)
+
+    index = np.full(len(trains.wells), np.nan)
+    # Segments are sorted by well, every well is one run of segments
+    well_starts = np.flatnonzero(np.r_[True, np.diff(trains.well_codes) != 0])
+    well_ends = np.r_[well_starts[1:], trains.segment_count]
+    for first, last in zip(well_starts, well_ends):
+        if last - first < 2:
+            continue
+        spikes = slice(trains.offsets[first], trains.offsets[last])
+        segment = np.repeat(np.arange(last - first),
+                            np.diff(trains.offsets[first:last + 1]))
+        counts = np.bincount(segment * bin_count + bins[spikes],
+                             minlength=(last - first) * bin_count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = np.corrcoef(counts.reshape(last - first, bin_count))
+        pairs = corr[np.triu_indices(last - first, k=1)]
+        if np.isfinite(pairs).any():
+            index[trains.well_codes[first]] = np.nanmean(pairs)
+
+    return (pd.Series(index, index=trains.wells)
+            .reindex(index=condition_labels)
+            .rename("Synchrony Index (mean pairwise spike count correlation) "
+                    "per Well"))
+
+
+def spike_train_tables(spikes, condition_labels: List[str], mins_recorded,
+                       options: Optional[spike_train_options] = None):
+    """Spike train metric tables from the spike time stamps.
+
+    spikes needs the 'Timestamp [µs]' column (load_mcs_csv with
+    extra_columns=SPIKE_TRAIN_COLUMNS) and its well labels already prefixed
+    with their condition (see core.mea_analysis.preprocess).
+    """
+    if TIMESTAMP_COL not in spikes:
+        raise ValueError(f"Spike train metrics need the '{TIMESTAMP_COL}' "
+                         "column of the spikes export")
+    options = options or spike_train_options()
+    with stage('sort'):
+        trains = spike_trains(spikes)
+
+    with stage('isi'):
+        tables = isi_tables(trains, condition_labels)
+        tables['isi_histogram'] = isi_histogram(trains, condition_labels,
+                                                options.isi_bins_per_decade)
+    with stage('firing_rate'):
+        tables['firing_rate'] = firing_rate(trains, condition_labels,
+                                            mins_recorded, options.rate_bin_s)
+    with stage('synchrony_index'):
+        tables['synchrony_index'] = synchrony_index(trains, condition_labels,
+                                                    mins_recorded,
+                                                    options.sync_bin_ms)
+    return tables
@@ -0,0 +1,156 @@
+import datetime
+import hashlib
+import os
+import re
+import tempfile
+from typing import List, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow.dataset as ds
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+STORE_COLUMNS = ['plate', 'base', 'date', 'condition', 'well', 'channel',
+                 'metric', 'value']
+
+# Dates in file names, e.g. 2021-06-14_plate1_spikes.csv or P3_20210614_...
+_NAME_DATE = re.compile(r'(?<!\d)((?:19|20)\d\d)[-_.]?(\d\d)[-_.]?(\d\d)'
+                        r'(?!\d)')
+
+
+def tidy_tables(tables, conditions, plate_name, base='', date=None,
+                levels=()):
+    """Long format version of the result tables of one plate.
+
+    One row per plate, well, channel (empty for the per-well network burst
+    tables) and metric (the output name of the table) with its value. The
+    well labels of the tables ('<condition>_<well>') are split into
+    condition and well again using the conditions mapping. Tables may have
+    additional outer index levels (e.g. a window index), named by levels,
+    which are kept as columns in front.
+    """
+    levels = list(levels)
+    label_to_well = {f'{line}_{well}': (line, well)
+                     for line, wells in conditions.items() for well in wells}
+
+    parts = []
+    for metric, table in tables.items():
+        if table.ndim == 1:
+            part = (table.rename('value')
+                    .rename_axis(levels + ['label']).reset_index())
+            part['channel'] = None
+        else:
+            part = (table.rename_axis(levels + ['channel']).reset_index()
+                    .melt(id_vars=levels + ['channel'], var_name='label',
+                          value_name='value'))
+            part['channel'] = part['channel'].astype(str)
+        part['metric'] = metric
+        parts.append(part)
+    data = pd.concat(parts, ignore_index=True)
+
+    wells = data.pop('label').map(label_to_well)
+    data['condition'] = wells.str[0]
+    data['well'] = wells.str[1]
+    data['plate'] = plate_name
+    data['base'] = base
+    data['date'] = pd.Timestamp(date) if date is not None else pd.NaT
+    data['value'] = data['value'].astype('float64')
+    return data[levels + STORE_COLUMNS]
+
+
+def _plate_file(store_dir, plate_name, base):
+    # Plates of different directories may have the same name
+    digest = hashlib.blake2b(os.path.abspath(base).encode(),
+                             digest_size=4).hexdigest()
+    safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_'
+                        for c in plate_name)
+    return os.path.join(store_dir, f'{safe_name}-{digest}.parquet')
+
+
+def add_plate(store_dir, tables, conditions, plate_name, base='', date=None):
+    """Append (or replace) the results of one plate in the store.
+
+    Every plate is one parquet file in store_dir, so plates can be added
+    while others are analyzed and a rerun just replaces its file.
+    """
+    if not HAS_PYARROW:
+        raise ImportError('The metrics store needs pyarrow')
+    os.makedirs(store_dir, exist_ok=True)
+    data = tidy_tables(tables, conditions, plate_name, base, date)
+
+    path = _plate_file(store_dir, plate_name, base)
+    fd, tmp = tempfile.mkstemp(dir=store_dir, suffix='.tmp')
+    os.close(fd)
+    try:
+        data.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+def query(store_dir, plates: Optional[List[str]] = None,
+          conditions: Optional[List[str]] = None,
+          wells: Optional[List[str]] = None,
+          metrics: Optional[List[str]] = None,
+          since=None, until=None) -> pd.DataFrame:
+    """Rows of the store matching all given filters.
+
+    The filters are pushed down to the parquet reader, only matching row
+    groups are read. since/until filter the recording date (inclusive).
+    """
+    if not HAS_PYARROW:
+        raise ImportError('The metrics store needs pyarrow')
+    files = [os.path.join(store_dir, f) for f in sorted(os.listdir(store_dir))
+             if f.endswith('.parquet')]
+    if not files:
+        return pd.DataFrame(columns=STORE_COLUMNS)
+
+    expr = None
+    for col, values in [('plate', plates), ('condition', conditions),
+                        ('well', wells), ('metric', metrics)]:
+        if values:
+            expr = _and(expr, ds.field(col).isin(list(values)))
+    if since is not None:
+        expr = _and(expr, ds.field('date') >= pd.Timestamp(since))
+    if until is not None:
+        until = pd.Timestamp(until)
+        if until == until.normalize():
+            # A plain date includes the whole day
+            until += pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+        expr = _and(expr, ds.field('date') <= until)
+
+    return ds.dataset(files, format='parquet').to_table(filter=expr).to_pandas()
+
+
+def _and(expr, other):
+    return other if expr is None else expr & other
+
+
+def pivot(data, index='condition', columns='metric', aggfunc='mean'):
+    """Summary table of the query result, e.g. mean metric per condition."""
+    return data.pivot_table(index=index, columns=columns, values='value',
+                            aggfunc=aggfunc)
+
+
+def recording_date(spikes_file, date=None):
+    """Date of a plate for the store.
+
+    The given date, else a date in the name of the spikes export (e.g.
+    2021-06-14_plate1_spikes.csv), else its modification time. Copying or
+    syncing the exports changes the latter, so where the date is queried
+    name the plates with it or pass it.
+    """
+    if date is not None:
+        return pd.Timestamp(date).to_pydatetime()
+    for match in _NAME_DATE.finditer(os.path.basename(spikes_file)):
+        try:
+            return datetime.datetime(*map(int, match.groups()))
+        except ValueError:
+            # Digits that are no date, e.g. 20211399
+            continue
+    return datetime.datetime.fromtimestamp(os.path.getmtime(spikes_file))
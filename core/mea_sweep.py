@@ -0,0 +1,266 @@
+import ast
+import dataclasses
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from core.file_cache import DEFAULT_CACHE_BYTES, file_cache
+from core.mea_analysis import analyze, read_conditions
+from core.mea_burst_detection import burst_detection_options, detect_all
+from core.mea_jobs import finished, report, run_quietly
+from core.mea_output import write_tables
+from core.mea_pipeline import load_plate, plate_files
+from core.mea_profile import PROFILE_NAME, profiling_mode, stage
+from core.mea_spike_trains import spike_train_options
+from core.mea_store import add_plate, recording_date
+from core.mea_windows import window_options
+
+SWEEP_DIR = 'sweep'
+SUMMARY_NAME = 'sweep_summary.csv'
+
+# Grid keys besides the fields of the burst detection and spike train
+# options
+VARIANT_KEYS = ['label', 'mins_recorded', 'conditions_file']
+
+_BURST_FIELDS = [f.name for f in dataclasses.fields(burst_detection_options)]
+_SPIKE_TRAIN_FIELDS = [f.name for f in dataclasses.fields(spike_train_options)]
+
+
+@dataclass
+class sweep_variant:
+    label: str
+    mins_recorded: int
+    conditions: Dict[str, List[str]]
+    spike_trains: Optional[spike_train_options] = None
+    burst_detection: Optional[burst_detection_options] = None
+    windows: Optional[window_options] = None
+
+
+@dataclass
+class variant_result:
+    label: str
+    status: str             # 'ok' or 'failed'
+    seconds: float = 0.
+    out_dir: str = ''
+    error: Optional[str] = None
+
+
+def read_sweep_grid(grid_file) -> List[Dict]:
+    """Parameter sets of a grid file (python literal, like conditions files).
+
+    The file holds either a list of parameter dicts, one per variant, or a
+    dict of parameter -> list of values, whose combinations are the
+    variants, e.g. {'mins_recorded': [5, 10], 'max_isi_end_ms': [50, 100]}.
+    """
+    with open(grid_file, 'r') as f:
+        grid = ast.literal_eval(f.read())
+    if isinstance(grid, dict):
+        keys = list(grid)
+        values = [v if isinstance(v, (list, tuple)) else [v]
+                  for v in grid.values()]
+        return [dict(zip(keys, combination))
+                for combination in itertools.product(*values)]
+    return [dict(params) for params in grid]
+
+
+def _label_value(key, value):
+    if key == 'conditions_file':
+        return os.path.splitext(os.path.basename(str(value)))[0]
+    if isinstance(value, float):
+        return f'{value:g}'
+    return str(value)
+
+
+def _label(params):
+    label = ','.join(f'{k}={_label_value(k, v)}'
+                     for k, v in params.items()) or 'default'
+    return ''.join(c if c.isalnum() or c in '-_.,=' else '_' for c in label)
+
+
+def make_variants(parameter_sets: List[Dict], files: plate_files,
+                  mins_recorded,
+                  spike_trains: Optional[spike_train_options] = None,
+                  burst_detection: Optional[burst_detection_options] = None,
+                  windows: Optional[window_options] = None
+                  ) -> List[sweep_variant]:
+    """Variants of a sweep, parameter sets applied on top of the defaults.
+
+    Parameters are mins_recorded, conditions_file (in the plate's
+    directory), label (the output directory name, by default made of the
+    parameters) and the fields of burst_detection_options and
+    spike_train_options. Setting one of the latter turns burst detection or
+    spike train metrics on for that variant.
+    """
+    allowed = VARIANT_KEYS + _BURST_FIELDS + _SPIKE_TRAIN_FIELDS
+    variants = []
+    labels = set()
+    for params in parameter_sets:
+        unknown = [k for k in params if k not in allowed]
+        if unknown:
+            raise ValueError(f'Unknown sweep parameter(s) {unknown}, known '
+                             f'are {allowed}')
+
+        conditions_file = os.path.join(
+                files.base, params.get('conditions_file',
+                                       os.path.basename(files.conditions_file)))
+        detection = burst_detection
+        burst_params = {k: v for k, v in params.items() if k in _BURST_FIELDS}
+        if burst_params:
+            detection = dataclasses.replace(
+                    detection or burst_detection_options(), **burst_params)
+        trains = spike_trains
+        train_params = {k: v for k, v in params.items()
+                        if k in _SPIKE_TRAIN_FIELDS}
+        if train_params:
+            trains = dataclasses.replace(
+                    trains or spike_train_options(), **train_params)
+
+        label = params.get('label') or _label(
+                {k: v for k, v in params.items() if k != 'label'})
+        if label in labels:
+            label = f'{label}_{len(variants)}'
+        labels.add(label)
+
+        variants.append(sweep_variant(
+                label=label,
+                mins_recorded=params.get('mins_recorded', mins_recorded),
+                conditions=read_conditions(conditions_file),
+                spike_trains=trains,
+                burst_detection=detection,
+                windows=windows))
+    return variants
+
+
+# Parsed tables of the plate, set before the workers are forked so that they
+# share them (copy on write) instead of getting a pickled copy each
+_SHARED = None
+
+
+def _analyze_variant(variant: sweep_variant, out_dir, output_modes,
+                     store, profile=None):
+    with profiling_mode(profile) as profiler:
+        spikes, bursts, net_bursts = _SHARED
+        if variant.burst_detection is not None:
+            with stage('detect_bursts'):
+                bursts, net_bursts = detect_all(spikes,
+                                                variant.burst_detection)
+        with stage('analyze'):
+            tables = analyze(spikes, bursts, net_bursts,
+                             variant.conditions, variant.mins_recorded,
+                             spike_trains=variant.spike_trains,
+                             windows=variant.windows)
+        with stage('write'):
+            write_tables(tables, out_dir, modes=output_modes)
+        if store is not None:
+            with stage('store'):
+                store_dir, plate_name, base, date = store
+                add_plate(store_dir, tables, variant.conditions,
+                          f'{plate_name}@{variant.label}', base, date)
+        if profile:
+            profiler.write(os.path.join(out_dir, PROFILE_NAME),
+                           variant=variant.label,
+                           options=dataclasses.asdict(variant))
+
+
+def _run_variant(variant: sweep_variant, out_dir, output_modes,
+                 store, profile=None) -> variant_result:
+    seconds, error = run_quietly(_analyze_variant, variant, out_dir,
+                                 output_modes, store, profile)
+    return variant_result(variant.label, 'failed' if error else 'ok',
+                          seconds, out_dir, error)
+
+
+def _variant_crashed(variant: sweep_variant, error) -> variant_result:
+    return variant_result(variant.label, 'failed', error=error)
+
+
+def run_sweep(files: plate_files, variants: List[sweep_variant],
+              workers=None, out_dir=None, stream_spikes=False, chunksize=None,
+              cache_dir=None, cache_size=DEFAULT_CACHE_BYTES,
+              output_modes=('xlsx',), store_dir=None,
+              profile=None, date=None) -> List[variant_result]:
+    """Analyze one plate with every variant, parsing its files only once.
+
+    The tables are loaded once and the variants are analyzed by a pool of
+    forked worker processes which share the loaded tables. Where fork is
+    not available (Windows) or with workers=1 the variants run one after
+    the other in this process. Every variant is written to
+    out_dir/<label> (out_dir defaults to <plate output>/sweep), a summary
+    of the run times to out_dir/sweep_summary.csv. With a store_dir the
+    results are added to the metrics store as plate '<plate>@<label>'.
+    With a profile mode (see run_plate), loading the plate is profiled to
+    out_dir/profile.json, those of every variant to out_dir/<label>/.
+    The other options are those of run_plate, the analysis options are
+    part of the variants (see make_variants).
+    """
+    global _SHARED
+    out_dir = out_dir or os.path.join(files.out_base, SWEEP_DIR)
+    cache = file_cache(cache_dir, cache_size) if cache_dir else None
+
+    detect_all_variants = all(v.burst_detection is not None
+                              for v in variants)
+    spike_times = any(v.burst_detection is not None
+                      or v.spike_trains is not None
+                      or v.windows is not None for v in variants)
+    start = time.perf_counter()
+    with profiling_mode(profile) as profiler:
+        with stage('load'):
+            _SHARED = load_plate(files, stream_spikes=stream_spikes,
+                                 chunksize=chunksize, cache=cache,
+                                 spike_times=spike_times,
+                                 load_bursts=not detect_all_variants)
+        if profile:
+            os.makedirs(out_dir, exist_ok=True)
+            profiler.write(os.path.join(out_dir, PROFILE_NAME),
+                           plate=files.plate_name)
+    print(f'Parsed {files.plate_name} in {time.perf_counter() - start:.1f} s')
+
+    store = None
+    if store_dir:
+        store = (store_dir, files.plate_name, files.base,
+                 recording_date(files.spikes_file, date))
+    jobs = [(v, os.path.join(out_dir, v.label), output_modes, store, profile)
+            for v in variants]
+
+    results = []
+    fork = 'fork' in multiprocessing.get_all_start_methods()
+    try:
+        if workers == 1 or not fork:
+            for job in jobs:
+                results.append(_run_variant(*job))
+                _report(results[-1])
+        else:
+            context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=context) as pool:
+                futures = {pool.submit(_run_variant, *job): job[0]
+                           for job in jobs}
+                for result in finished(futures, _variant_crashed):
+                    results.append(result)
+                    _report(result)
+    finally:
+        _SHARED = None
+
+    summary = sweep_summary(results)
+    os.makedirs(out_dir, exist_ok=True)
+    summary.to_csv(os.path.join(out_dir, SUMMARY_NAME), index=False)
+    print(summary.to_string(index=False))
+    return results
+
+
+def _report(result: variant_result):
+    report(result.status, result.label, result.seconds, result.error)
+
+
+def sweep_summary(results: List[variant_result]) -> pd.DataFrame:
+    """Run time and status of every variant."""
+    return pd.DataFrame({'variant': [r.label for r in results],
+                         'status': [r.status for r in results],
+                         'seconds': [round(r.seconds, 2) for r in results],
+                         'output': [r.out_dir for r in results]})
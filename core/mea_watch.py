@@ -0,0 +1,201 @@
+import json
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional
+
+from core.mea_batch import (discover_plates, plate_crashed, plate_result,
+                            report_plate, run_plate_job)
+from core.mea_jobs import result_of
+from core.mea_options import BURSTS_SUFFIX, NET_BURSTS_SUFFIX, SPIKES_SUFFIX
+from core.mea_pipeline import plate_files
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    HAS_WATCHDOG = True
+except ImportError:
+    HAS_WATCHDOG = False
+
+STATE_NAME = '.mea_watch_state.json'
+STATE_VERSION = 1
+
+
+def file_signature(files: plate_files):
+    """[size, mtime] of every input file, from stat only (no reading)."""
+    signature = []
+    for fname in files.inputs:
+        try:
+            st = os.stat(fname)
+            signature.append([st.st_size, st.st_mtime_ns])
+        except FileNotFoundError:
+            signature.append(None)
+    return signature
+
+
+class watch_state():
+    """Plates the watcher has processed, kept in a JSON file.
+
+    Every plate (by its spikes file relative to the watched directory) is
+    stored with the signature of its input files when it was processed, so
+    that after a restart it is only processed again if its files changed.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.plates: Dict[str, dict] = dict()
+        if os.path.isfile(filename):
+            with open(filename, 'r') as f:
+                state = json.load(f)
+            if state.get('version') == STATE_VERSION:
+                self.plates = state['plates']
+
+    def is_done(self, key, signature):
+        """True if the plate was processed (or failed) with these files."""
+        entry = self.plates.get(key)
+        return entry is not None and entry['signature'] == signature
+
+    def record(self, key, signature, result: plate_result):
+        self.plates[key] = {
+                'signature': signature,
+                'status': result.status,
+                'seconds': round(result.seconds, 2),
+                'finished': datetime.now().isoformat(timespec='seconds'),
+                'error': result.error}
+        self.save()
+
+    def save(self):
+        # Replace atomically, a crash must not leave a truncated state
+        tmp = f'{self.filename}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': STATE_VERSION, 'plates': self.plates}, f,
+                      indent=1)
+        os.replace(tmp, self.filename)
+
+
+def _start_observer(base_dir, wake: threading.Event):
+    # Wakes the watcher as soon as something changes below base_dir
+    class _handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            wake.set()
+
+    observer = Observer()
+    observer.schedule(_handler(), base_dir, recursive=True)
+    observer.daemon = True
+    observer.start()
+    return observer
+
+
+def _ignore_interrupt():
+    # Ctrl+C is handled by the watcher, which lets running plates finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _finish(future, key, files: plate_files, signature, state: watch_state):
+    result = result_of(future, files, plate_crashed)
+    state.record(key, signature, result)
+    report_plate(result)
+
+
+def watch(base_dir, mins_recorded, conditions_fname='conditions.txt',
+          spikes_suffix=SPIKES_SUFFIX, bursts_suffix=BURSTS_SUFFIX,
+          net_bursts_suffix=NET_BURSTS_SUFFIX, workers=None, interval=10.,
+          settle=30., state_file: Optional[str] = None, once=False,
+          use_events=True, **run_options):
+    """Analyze the plates appearing below base_dir as they are exported.
+
+    base_dir is scanned every interval seconds (and, with the watchdog
+    package installed and use_events, whenever a file changes) for
+    complete plates like in batch mode. A plate is queued once the size
+    and modification time of all its files have not changed for settle
+    seconds, i.e. the export has finished. Files are only stat'ed, never
+    read, until the plate is analyzed. At most workers plates are analyzed
+    at a time in a process pool. Processed (and failed) plates are kept in
+    state_file (default: <base_dir>/.mea_watch_state.json) and are only
+    analyzed again if their files change, also after a restart. Ctrl+C
+    stops the watcher after the running plates are finished. With once,
+    the watcher returns as soon as all plates found are processed instead
+    of running until interrupted. run_options are passed on to run_plate.
+    """
+    if not os.path.isdir(base_dir):
+        raise FileNotFoundError(f'{base_dir} does not exist!')
+    state = watch_state(state_file or os.path.join(base_dir, STATE_NAME))
+    need_bursts = run_options.get('burst_detection') is None
+    workers = workers or os.cpu_count()
+
+    # Key -> [files, signature, time since which the signature is unchanged]
+    pending = dict()
+    queue = []
+    running = dict()
+    wake = threading.Event()
+    observer = None
+    if use_events and HAS_WATCHDOG:
+        observer = _start_observer(base_dir, wake)
+    print(f'Watching {base_dir} for new plates '
+          f'({"file system events" if observer else "scanning"} every '
+          f'{interval:g} s, {workers} workers), stop with Ctrl+C')
+
+    pool = ProcessPoolExecutor(max_workers=workers,
+                               initializer=_ignore_interrupt)
+    try:
+        while True:
+            now = time.monotonic()
+            busy = {key for key, _, _ in queue} | {key for key, _, _ in
+                                                    running.values()}
+            seen = set()
+            for files in discover_plates(
+                    base_dir, conditions_fname, spikes_suffix=spikes_suffix,
+                    bursts_suffix=bursts_suffix,
+                    net_bursts_suffix=net_bursts_suffix,
+                    need_bursts=need_bursts, report_missing=False):
+                key = os.path.relpath(files.spikes_file, base_dir)
+                seen.add(key)
+                if key in busy:
+                    continue
+                signature = file_signature(files)
+                if state.is_done(key, signature):
+                    pending.pop(key, None)
+                    continue
+                entry = pending.get(key)
+                if entry is None or entry[1] != signature:
+                    # New or still being written
+                    pending[key] = [files, signature, now]
+                elif now - entry[2] >= settle:
+                    del pending[key]
+                    queue.append((key, files, signature))
+                    print(f'[queued]  {files.out_base}')
+            for key in set(pending) - seen:
+                # Removed again before it settled
+                del pending[key]
+
+            while queue and len(running) < workers:
+                key, files, signature = queue.pop(0)
+                future = pool.submit(run_plate_job, files, mins_recorded,
+                                     run_options)
+                future.add_done_callback(lambda _: wake.set())
+                running[future] = (key, files, signature)
+
+            for future in [f for f in running if f.done()]:
+                _finish(future, *running.pop(future), state)
+
+            if once and not pending and not queue and not running:
+                return
+            # Come back when the next pending plate may have settled
+            timeout = interval
+            if pending:
+                timeout = min(timeout, max(min(
+                        entry[2] + settle for entry in pending.values())
+                        - time.monotonic(), 0.1))
+            wake.wait(timeout)
+            wake.clear()
+    except KeyboardInterrupt:
+        print(f'Stopping, waiting for {len(running)} running plates '
+              '(Ctrl+C again to abort them)')
+        for future, job in running.items():
+            _finish(future, *job, state)
+    finally:
+        if observer is not None:
+            observer.stop()
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,108 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from core.mea_options import window_options
+from core.mea_profile import stage
+from core.mea_spike_trains import TIMESTAMP_COL
+from core.mea_store import tidy_tables
+
+WINDOWED_OUTPUT_NAME = 'windowed_metrics'
+
+WINDOW_COLUMNS = ['window_start [s]', 'window_end [s]', 'condition', 'well',
+                  'channel', 'metric', 'value']
+
+
+def window_starts(duration_us, window_us, step_us):
+    """Start times [µs] of the complete windows within the recording."""
+    count = max(int((duration_us - window_us) // step_us) + 1, 1)
+    return np.arange(count, dtype=np.int64) * step_us
+
+
+def assign_windows(start, end, window_us, step_us, count):
+    """Row and window index of every event/window pair.
+
+    Events are [start, end) intervals (start == end for points), window k
+    is [k * step_us, k * step_us + window_us). An event is in all windows
+    it overlaps, so in several if windows overlap. One np.repeat over all
+    events, no loop over windows.
+    """
+    start = np.asarray(start, dtype=np.int64)
+    end = np.maximum(np.asarray(end, dtype=np.int64) - 1, start)
+    first = np.maximum((start - window_us) // step_us + 1, 0)
+    last = np.minimum(end // step_us, count - 1)
+    n = np.maximum(last - first + 1, 0)
+
+    rows = np.repeat(np.arange(len(start)), n)
+    # Position of every pair within its event's run of windows
+    within = np.arange(len(rows)) - np.repeat(np.cumsum(n) - n, n)
+    return rows, first[rows] + within
+
+
+def _window_rows(start, end, window_us, step_us, count):
+    # Rows and bounds, the rows of window k are rows[bounds[k]:bounds[k + 1]]
+    rows, window = assign_windows(start, end, window_us, step_us, count)
+    order = np.argsort(window, kind='stable')
+    return rows[order], np.searchsorted(window[order], np.arange(count + 1))
+
+
+def windowed_metrics(spikes, bursts, net_bursts, conditions: Dict[str, List],
+                     mins_recorded, options: window_options, table_functions):
+    """Metric tables of every window as one tidy table.
+
+    spikes, bursts and net_bursts are preprocessed (core.mea_analysis)
+    tables, spikes with the spike time stamps. The rows of every window are
+    found once (see assign_windows), but only the window whose tables are
+    computed is copied out of them. table_functions(spikes, bursts,
+    net_bursts, window_mins) computes the name -> table dict of a window.
+    The tables of all windows are stacked per metric and made long at once.
+    Returns one row per window, well, channel (empty for per well metrics)
+    and metric.
+    """
+    if TIMESTAMP_COL not in spikes:
+        raise ValueError(f"Windowed metrics need the '{TIMESTAMP_COL}' "
+                         "column of the spikes export")
+
+    window_us = int(options.window_s * 1e6)
+    step_us = int(options.step_s * 1e6)
+    starts = window_starts(int(mins_recorded * 60e6), window_us, step_us)
+    count = len(starts)
+
+    def interval(data):
+        start = data['Start timestamp [µs]'].to_numpy(np.int64)
+        if options.assign == 'overlap':
+            return start, data['End timestamp [µs]'].to_numpy(np.int64)
+        return start, start
+
+    with stage('split'):
+        spike_times = spikes[TIMESTAMP_COL].to_numpy(np.int64)
+        split = [(data, *_window_rows(*times, window_us, step_us, count))
+                 for data, times in [(spikes, (spike_times, spike_times)),
+                                     (bursts, interval(bursts)),
+                                     (net_bursts, interval(net_bursts))]]
+
+    # Metric -> its table of every window
+    by_metric = dict()
+    with stage('tables'):
+        for k in range(count):
+            # Only the tables of this window are copied
+            window_data = [data.iloc[rows[bounds[k]:bounds[k + 1]]]
+                           for data, rows, bounds in split]
+            tables = table_functions(*window_data, options.window_s / 60)
+            for name, table in tables.items():
+                by_metric.setdefault(name, []).append(table)
+
+    with stage('tidy'):
+        # The window index as outer index level of every table, the columns
+        # (condition labels) are the same in all windows
+        stacked = {name: pd.concat(parts, keys=range(count), names=['window'])
+                   for name, parts in by_metric.items()}
+        data = tidy_tables(stacked, conditions, plate_name='',
+                           levels=['window'])
+        # Window by window, like the tables of a single window
+        data = data.sort_values('window', kind='stable', ignore_index=True)
+        window = data.pop('window').to_numpy()
+        data['window_start [s]'] = starts[window] / 1e6
+        data['window_end [s]'] = (starts[window] + window_us) / 1e6
+    return data[WINDOW_COLUMNS]
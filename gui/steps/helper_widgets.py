@@ -1,10 +1,19 @@
+import json
+import math
 import os
 
 from PyQt5 import QtWidgets, QtWebEngineWidgets
-from PyQt5.QtCore import QUrl
+from PyQt5.QtCore import QObject, QUrl, pyqtSlot
+from PyQt5.QtWebChannel import QWebChannel
 import plotly.graph_objects as go
 import pkgutil
 
+from core.downsample import sweep_traces
+
+# Width in pixels the traces are downsampled to before the plot is shown,
+# the view reports its real width once it is loaded
+INITIAL_PLOT_WIDTH = 2000
+
 
 from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
@@ -20,19 +29,37 @@ class _ep_mpl_plot_area(FigureCanvas):
         self.setParent(parent)
         FigureCanvas.setSizePolicy(self, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
         FigureCanvas.updateGeometry(self)
+        # core.file_cache for the envelope pyramids of loaded files
+        self.lod_cache = None
         #self.plot()
 
-    def plot_data(self, data):
-        #self.figure = go.Figure()
-        #self.axes.hold(True)
-        for c, sweeps in data.sweeps.items():
-            for s, sweep in sweeps.items():
-        #        self.figure.add_trace(go.Scatter(x=sweep.x, y=sweep.y, name=f'Channel {c} Sweep {s}'))
-                self.axes.plot(sweep.x, sweep.y)
-        #self.figure.update_traces()
-        
+    def prepare_data(self, data, progress=None):
+        # Downsampling the traces does not touch the canvas, it may run in a
+        # worker thread
+        traces = sweep_traces(data, progress, self.lod_cache)
+        return [trace for sweeps in traces.values()
+                for trace in sweeps.values()]
+
+    def plot_prepared(self, traces):
+        # Only what the axes can show is plotted, zooming or panning
+        # replaces the lines with the detail of the new range
+        self.axes.clear()
+        self.traces = traces
+        width = self.axes.bbox.width
+        self.lines = [self.axes.plot(*trace.view(width))[0]
+                      for trace in traces]
+        self.axes.callbacks.connect('xlim_changed', self.on_xlim_changed)
         self.draw()
-        #self.setContent(self.figure.to_html())
+
+    def on_xlim_changed(self, axes):
+        x_range = axes.get_xlim()
+        width = axes.bbox.width
+        for line, trace in zip(self.lines, self.traces):
+            line.set_data(*trace.view(width, x_range))
+        self.draw_idle()
+
+    def plot_data(self, data):
+        self.plot_prepared(self.prepare_data(data))
 
 class ep_quickplot_mpl(QtWidgets.QWidget):
     def __init__(self, parent=None):
@@ -43,33 +70,116 @@ class ep_quickplot_mpl(QtWidgets.QWidget):
         self.layout().addWidget(self.toolbar)
         self.layout().addWidget(self.canvas)
     
+    @property
+    def lod_cache(self):
+        return self.canvas.lod_cache
+
+    @lod_cache.setter
+    def lod_cache(self, cache):
+        self.canvas.lod_cache = cache
+
+    def prepare_plot(self, data, progress=None):
+        return self.canvas.prepare_data(data, progress)
+
+    def show_plot(self, prepared):
+        self.canvas.plot_prepared(prepared)
+
     def plot(self, data):
         self.canvas.plot_data(data)
 
+class _ep_plotly_bridge(QObject):
+    # Receives the x range of the plot from the page through the web channel
+    def __init__(self, view):
+        super(_ep_plotly_bridge, self).__init__(view)
+        self.view = view
+
+    @pyqtSlot(float, float, int)
+    def relayout(self, x0, x1, width):
+        x_range = None if math.isnan(x0) or math.isnan(x1) else (x0, x1)
+        self.view.update_view(x_range, width)
+
+# Sends zoom and pan of the plot to the bridge, NaN means the full range
+_RELAYOUT_JS = """
+<script src="qrc:///qtwebchannel/qwebchannel.js"></script>
+<script>
+new QWebChannel(qt.webChannelTransport, function (channel) {
+    var bridge = channel.objects.bridge;
+    var plot = document.getElementById('ep_quickplot');
+    plot.on('plotly_relayout', function (e) {
+        if (e['xaxis.autorange']) {
+            bridge.relayout(NaN, NaN, plot.offsetWidth);
+        } else if ('xaxis.range[0]' in e) {
+            bridge.relayout(e['xaxis.range[0]'], e['xaxis.range[1]'],
+                            plot.offsetWidth);
+        } else if ('xaxis.range' in e) {
+            bridge.relayout(e['xaxis.range'][0], e['xaxis.range'][1],
+                            plot.offsetWidth);
+        }
+    });
+    bridge.relayout(NaN, NaN, plot.offsetWidth);
+});
+</script>
+"""
+
 class ep_quickplot(QtWebEngineWidgets.QWebEngineView):
     def __init__(self, parent=None):
         super(ep_quickplot, self).__init__(parent)
         self.plotlyjs_path = os.path.join(os.path.dirname(pkgutil.get_loader("plotly").path), "package_data", "plotly.min.js").replace("\\", "/")
         self.figure = go.Figure()
+        self.traces = []
+        # core.file_cache for the envelope pyramids of loaded files
+        self.lod_cache = None
+        self.bridge = _ep_plotly_bridge(self)
+        self.channel = QWebChannel(self)
+        self.channel.registerObject('bridge', self.bridge)
 
-    def plot(self, data):
+    def prepare_plot(self, data, progress=None):
+        # Downsampling and building the html does not touch the widget, it
+        # may run in a worker thread. The page only gets the traces
+        # downsampled to the plot width, update_view replaces them with
+        # more detail on zoom.
         print(data.filename)
-        #self.figure.data = []
-        self.setPage(QtWebEngineWidgets.QWebEnginePage(self))
         figure = go.Figure()
-        for c, sweeps in data.sweeps.items():
-            for s, sweep in sweeps.items():
-                figure.add_trace(go.Scatter(x=sweep.x, y=sweep.y, name=f'Channel {c} Sweep {s}'))
+        traces = []
+        for c, sweeps in sweep_traces(data, progress, self.lod_cache).items():
+            for s, trace in sweeps.items():
+                x, y = trace.view(INITIAL_PLOT_WIDTH)
+                figure.add_trace(go.Scatter(x=x, y=y, name=f'Channel {c} Sweep {s}'))
+                traces.append(trace)
         
         figure.update_traces()
         raw_html = '<html><head><meta charset="utf-8" />'
         raw_html += f'<script src="file://{self.plotlyjs_path}"></script></head>'
         raw_html += '<body>'
-        raw_html += figure.to_html(include_plotlyjs=False, full_html=False)
+        raw_html += figure.to_html(include_plotlyjs=False, full_html=False,
+                                   div_id='ep_quickplot')
+        raw_html += _RELAYOUT_JS
         raw_html += '</body></html>'
+        return raw_html, traces
 
+    def plot(self, data):
+        self.show_plot(self.prepare_plot(data))
+
+    def show_plot(self, prepared):
+        raw_html, self.traces = prepared
+        #self.figure.data = []
+        self.setPage(QtWebEngineWidgets.QWebEnginePage(self))
+        self.page().setWebChannel(self.channel)
         QtWebEngineWidgets.QWebEngineProfile().clearHttpCache()
         self.setHtml(raw_html, QUrl('file://'))
         #self.reload()
         print(self.figure.data)
-        pass
\ No newline at end of file
+        pass
+
+    def update_view(self, x_range, width):
+        if not self.traces:
+            return
+        xs, ys = [], []
+        for trace in self.traces:
+            x, y = trace.view(width, x_range)
+            xs.append(x.tolist())
+            ys.append(y.tolist())
+        update = json.dumps({'x': xs, 'y': ys})
+        indices = list(range(len(self.traces)))
+        self.page().runJavaScript(
+                f"Plotly.restyle('ep_quickplot', {update}, {indices});")
\ No newline at end of file
@@ -0,0 +1,61 @@
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+from core.datareader import abf_data
+
+
+class ep_load_signals(QObject):
+    # generation, percent, message
+    progress = pyqtSignal(int, int, str)
+    # generation, (abf_data, sweep_data, prepared plot)
+    finished = pyqtSignal(int, object)
+    # generation, message
+    failed = pyqtSignal(int, str)
+
+
+class load_cancelled(Exception):
+    pass
+
+
+class ep_load_worker(QRunnable):
+    """Loads an ABF file and prepares its plot off the GUI thread.
+
+    prepare_plot(data, progress) does everything of plotting that does not
+    touch widgets, progress(done, total) is called while it runs. Every load
+    gets a generation number, a load is abandoned as soon as cancelled()
+    says that a newer one was started, and all signals carry the generation
+    so that stale results can be dropped.
+    """
+    def __init__(self, generation, filename, prepare_plot, cancelled):
+        super(ep_load_worker, self).__init__()
+        self.generation = generation
+        self.filename = filename
+        self.prepare_plot = prepare_plot
+        self.cancelled = cancelled
+        self.signals = ep_load_signals()
+
+    def _progress(self, percent, message):
+        if self.cancelled():
+            raise load_cancelled()
+        self.signals.progress.emit(self.generation, percent, message)
+
+    def run(self):
+        try:
+            self._progress(0, 'Opening file')
+            data_file = abf_data(self.filename)
+            self._progress(10, 'Reading sweeps')
+            data = data_file.get_data()
+            self._progress(20, 'Preparing plot')
+
+            def plot_progress(done, total):
+                self._progress(20 + int(80 * done / max(total, 1)),
+                               'Preparing plot')
+            prepared = self.prepare_plot(data, plot_progress)
+            self._progress(100, 'Done')
+        except load_cancelled:
+            return
+        except Exception as e:
+            self.signals.failed.emit(self.generation,
+                                     f'{type(e).__name__}: {e}')
+            return
+        self.signals.finished.emit(self.generation,
+                                   (data_file, data, prepared))
@@ -1,15 +1,31 @@
 from .step import ep_step
+from .load_worker import ep_load_worker
+from core.downsample import default_lod_cache
 
-from PyQt5.QtCore import pyqtSlot
+from PyQt5.QtCore import QThreadPool, QTimer, pyqtSlot
 from PyQt5.QtWidgets import QFileDialog
 
-from core.datareader import abf_data
+# Time the filename has to stay unchanged before it is loaded
+LOAD_DELAY_MS = 400
 
 
 class ep_step_load_single_file(ep_step):
     def __init__(self, parent=None):
         super(ep_step_load_single_file, self).__init__(parent)
 
+        # Loading runs in the thread pool. Typing restarts the timer, so only
+        # the final path is loaded, and every load increments the generation,
+        # which makes older loads stop and their results be ignored.
+        self._load_timer = QTimer(self)
+        self._load_timer.setSingleShot(True)
+        self._load_timer.setInterval(LOAD_DELAY_MS)
+        self._load_timer.timeout.connect(self.start_loading)
+        self._load_generation = 0
+        self._load_worker = None
+        self.ui.load_progress.hide()
+        # Reopened files are plotted from their cached envelope pyramids
+        self.ui.quickplot.lod_cache = default_lod_cache()
+
         # Define interactions
         self.ui.browse.clicked.connect(self.on_browse)
         self.ui.filename.textChanged.connect(self.on_filename_changed)
@@ -30,22 +46,61 @@ class ep_step_load_single_file(ep_step):
 
     @pyqtSlot(str)
     def on_filename_changed(self, new_filename: str):
-        try:
-            self.data_file = abf_data(new_filename)
-        except NotImplementedError as e:
-            self._set_filestatus(f'Could not read file ({str(e)})', False)
+        # Supersede a running load right away, start the new one once the
+        # text stops changing
+        self._load_generation += 1
+        self._load_timer.start()
+
+    @pyqtSlot()
+    def start_loading(self):
+        self._load_generation += 1
+        generation = self._load_generation
+        filename = self.ui.filename.text()
+        if not filename:
+            self.ui.load_progress.hide()
+            self._set_filestatus('<no file>', False)
+            return
+
+        self._load_worker = ep_load_worker(
+                generation, filename, self.ui.quickplot.prepare_plot,
+                lambda: generation != self._load_generation)
+        self._load_worker.signals.progress.connect(self.on_load_progress)
+        self._load_worker.signals.finished.connect(self.on_load_finished)
+        self._load_worker.signals.failed.connect(self.on_load_failed)
+
+        self._set_filestatus('Loading...', True)
+        self.ui.load_progress.setValue(0)
+        self.ui.load_progress.show()
+        QThreadPool.globalInstance().start(self._load_worker)
+
+    @pyqtSlot(int, int, str)
+    def on_load_progress(self, generation: int, percent: int, message: str):
+        if generation != self._load_generation:
+            return
+        self.ui.load_progress.setValue(percent)
+        self.ui.load_progress.setFormat(f'{message} (%p%)')
+
+    @pyqtSlot(int, object)
+    def on_load_finished(self, generation: int, result):
+        if generation != self._load_generation:
             return
-        
+        self.data_file, self.data, prepared_plot = result
+        self.ui.load_progress.hide()
         self._set_filestatus(f'OK', True)
-        self.data = self.data_file.get_data()
 
         self.ui.fileinfo_protocol.setText(self.data.protocol)
         self.ui.fileinfo_sweepcount.setText(str(self.data.sweep_count))
         self.ui.fileinfo_channelcount.setText(str(self.data.channel_count))
         self.ui.fileinfo_timestamp.setText(self.data.timestamp)
-        self.ui.quickplot.plot(self.data)
+        self.ui.quickplot.show_plot(prepared_plot)
+
+    @pyqtSlot(int, str)
+    def on_load_failed(self, generation: int, message: str):
+        if generation != self._load_generation:
+            return
+        self.ui.load_progress.hide()
+        self._set_filestatus(f'Could not read file ({message})', False)
 
-    
     def _set_filestatus(self, text: str, status: bool):
         self.ui.fileinfo_status.setText(text)
         if status:
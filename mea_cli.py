@@ -0,0 +1,568 @@
+import argparse
+from argparse import ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
+from datetime import datetime
+import sys
+
+# Only light (standard library) modules at the top, so that starting the
+# command line, --help and argument errors do not wait for NumPy/pandas.
+# The analysis is imported by the subcommands that run it.
+from core.file_cache import DEFAULT_CACHE_BYTES, DEFAULT_CACHE_DIR, file_cache
+from core.mea_options import (BURSTS_SUFFIX, NET_BURSTS_SUFFIX, OUTPUT_MODES,
+                              SPIKES_SUFFIX, burst_detection_options,
+                              spike_train_options, window_options)
+
+CONDITIONS_EXAMPLE = ('Example contents of a condition file:\n\n'
+                      '{\n'
+                      '\t\'K2_16\': [\'A1\',\'A2\',\'B1\',\'B2\',\'C1\','
+                      '\'C2\',\'D1\',\'D2\'],\n'
+                      '\t\'P7_3\': [\'A3\',\'A4\',\'B3\',\'B4\'],\n'
+                      '\t\'P7_15\': [\'C3\',\'C4\',\'D3\'],\n'
+                      '\t\'P8_10\': [\'A5\',\'A6\',\'B5\',\'B6\'],\n'
+                      '\t\'KK2_11\': [\'C5\',\'C6\',\'D5\'],\n'
+                      '\t\'empty\': [\'D4\',\'D6\']\n'
+                      '}')
+
+
+class help_formatter(ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter):
+    pass
+
+
+def add_plate_arguments(parser, gooey=False):
+    """Arguments of a single plate run, shared with the Gooey script."""
+    dir_widget = dict(widget="DirChooser") if gooey else dict()
+    parser.add_argument("base_dir",
+                        type=str,
+                        help="base directory (e.g. /mnt/data/multiwell/csv/)",
+                        **dir_widget)
+
+    parser.add_argument("conditions_file",
+                        type=str,
+                        help=("name of the file that specifies the"
+                        "lines/conditions per well as a python dictionary (e.g."
+                        "conditions.txt)"))
+
+    parser.add_argument("mins_recorded",
+                        type=int,
+                        help="minutes recorded, e.g. 5")
+
+    parser.add_argument("spikes_file",
+                        type=str,
+                        help="spikes csv file name (e.g. spikes_test.csv)")
+
+    parser.add_argument("bursts_file",
+                        type=str,
+                        help="bursts csv file name")
+
+    parser.add_argument("net_bursts_file",
+                        type=str,
+                        help="network bursts csv file name")
+
+
+def add_discovery_arguments(parser):
+    """Optional arguments on how plates are found below a directory."""
+    parser.add_argument("--conditions-file",
+                        type=str,
+                        default='conditions.txt',
+                        help=("conditions file name, looked up as "
+                              "'<plate>_<name>' and then '<name>' next to "
+                              "the plate's csv files"))
+
+    parser.add_argument("--spikes-suffix",
+                        default=SPIKES_SUFFIX,
+                        help="file name suffix of spikes csv files")
+
+    parser.add_argument("--bursts-suffix",
+                        default=BURSTS_SUFFIX,
+                        help="file name suffix of bursts csv files")
+
+    parser.add_argument("--net-bursts-suffix",
+                        default=NET_BURSTS_SUFFIX,
+                        help="file name suffix of network bursts csv files")
+
+
+def add_load_arguments(parser):
+    """Optional arguments on how the csv files are loaded."""
+    parser.add_argument("--stream-spikes",
+                        action='store_true',
+                        help=("only count the spikes per channel and well "
+                              "while reading the spikes csv in chunks, for "
+                              "exports larger than the memory"))
+
+    parser.add_argument("--chunksize",
+                        type=int,
+                        default=None,
+                        help=("rows per chunk when reading the spikes csv in "
+                              "chunks (default: only chunk files > 1 GiB, "
+                              "2000000 rows)"))
+
+
+    parser.add_argument("--cache-dir",
+                        type=str,
+                        default=DEFAULT_CACHE_DIR,
+                        help=("directory in which parsed csv files are cached "
+                              "(needs pyarrow)"))
+
+    parser.add_argument("--cache-size",
+                        type=float,
+                        default=DEFAULT_CACHE_BYTES / 1024 ** 3,
+                        help=("maximum size of the cache in GiB, least "
+                              "recently used files are removed first"))
+
+    parser.add_argument("--no-cache",
+                        action='store_true',
+                        help="neither use nor fill the cache")
+
+    parser.add_argument("--clear-cache",
+                        action='store_true',
+                        help="empty the cache before running")
+
+
+def add_analysis_arguments(parser):
+    """Optional arguments on which metrics are computed."""
+    parser.add_argument("--spike-trains",
+                        action='store_true',
+                        help=("also compute spike train metrics (ISI mean, "
+                              "CV and histogram, firing rate time courses, "
+                              "synchrony) from the spike time stamps"))
+
+    parser.add_argument("--rate-bin",
+                        type=float,
+                        default=spike_train_options.rate_bin_s,
+                        help="bin width of the firing rate time courses in s")
+
+    parser.add_argument("--sync-bin",
+                        type=float,
+                        default=spike_train_options.sync_bin_ms,
+                        help=("bin width of the spike counts that are "
+                              "correlated for the synchrony index in ms"))
+
+    parser.add_argument("--window",
+                        type=float,
+                        default=None,
+                        help=("also compute all metrics per time window of "
+                              "this many seconds, written as one long table "
+                              "(windowed_metrics)"))
+
+    parser.add_argument("--window-step",
+                        type=float,
+                        default=None,
+                        help=("seconds between window starts, windows "
+                              "overlap if shorter than --window (default: "
+                              "--window, i.e. consecutive windows)"))
+
+    parser.add_argument("--window-assign",
+                        choices=['start', 'overlap'],
+                        default=window_options.assign,
+                        help=("bursts belong to the windows their start falls "
+                              "into or to all windows they overlap"))
+
+    defaults = burst_detection_options()
+    parser.add_argument("--detect-bursts",
+                        action='store_true',
+                        help=("detect bursts and network bursts in the spike "
+                              "time stamps (max interval method) instead of "
+                              "reading the bursts csv files"))
+
+    parser.add_argument("--max-isi-start",
+                        type=float,
+                        default=defaults.max_isi_start_ms,
+                        help="max interval to start a burst in ms")
+
+    parser.add_argument("--max-isi-end",
+                        type=float,
+                        default=defaults.max_isi_end_ms,
+                        help="max interval within a burst in ms")
+
+    parser.add_argument("--min-ibi",
+                        type=float,
+                        default=defaults.min_ibi_ms,
+                        help="bursts closer than this (in ms) are merged")
+
+    parser.add_argument("--min-burst-duration",
+                        type=float,
+                        default=defaults.min_duration_ms,
+                        help="min burst duration in ms")
+
+    parser.add_argument("--min-burst-spikes",
+                        type=int,
+                        default=defaults.min_spike_count,
+                        help="min number of spikes in a burst")
+
+    parser.add_argument("--nb-min-channels",
+                        type=int,
+                        default=defaults.nb_min_channels,
+                        help=("min number of electrodes of a well bursting "
+                              "at the same time for a network burst"))
+
+    parser.add_argument("--nb-min-ibi",
+                        type=float,
+                        default=defaults.nb_min_ibi_ms,
+                        help="network bursts closer than this (in ms) are merged")
+
+    parser.add_argument("--nb-min-duration",
+                        type=float,
+                        default=defaults.nb_min_duration_ms,
+                        help="min network burst duration in ms")
+
+
+def add_output_arguments(parser):
+    """Optional arguments on how the result tables are written."""
+    parser.add_argument("--output",
+                        nargs='+',
+                        choices=OUTPUT_MODES,
+                        default=['xlsx'],
+                        help=("output format(s): xlsx (one file per table), "
+                              "workbook (all tables in results.xlsx), csv, "
+                              "parquet or xlsx-parallel (one file per table, "
+                              "written in parallel)"))
+
+    parser.add_argument("--store",
+                        type=str,
+                        default=None,
+                        help=("directory of a metrics store (see the query "
+                              "command) the results are added to"))
+
+    parser.add_argument("--date",
+                        type=datetime.fromisoformat,
+                        default=None,
+                        help=("recording date stored with the results, e.g. "
+                              "2021-06-14 (the same for all plates of a "
+                              "batch), by default a date in the spikes file "
+                              "name, else its modification time, which "
+                              "changes when the exports are copied"))
+
+    parser.add_argument("--profile",
+                        action='store_true',
+                        help=("write the wall time of every stage to "
+                              "profile.json in the output folder"))
+
+    parser.add_argument("--profile-memory",
+                        action='store_true',
+                        help=("profile the peak memory of every stage as well "
+                              "(implies --profile), the memory tracing slows "
+                              "allocation heavy stages down, so the times of "
+                              "such a profile are not representative"))
+
+
+def run_options(args):
+    """Keyword arguments of run_plate given on the command line."""
+    if args.clear_cache:
+        file_cache(args.cache_dir).clear()
+        print(f'Cleared cache {args.cache_dir}')
+    spike_trains = None
+    if args.spike_trains:
+        spike_trains = spike_train_options(rate_bin_s=args.rate_bin,
+                                           sync_bin_ms=args.sync_bin)
+    burst_detection = None
+    if args.detect_bursts:
+        burst_detection = burst_detection_options(
+                max_isi_start_ms=args.max_isi_start,
+                max_isi_end_ms=args.max_isi_end,
+                min_ibi_ms=args.min_ibi,
+                min_duration_ms=args.min_burst_duration,
+                min_spike_count=args.min_burst_spikes,
+                nb_min_channels=args.nb_min_channels,
+                nb_min_ibi_ms=args.nb_min_ibi,
+                nb_min_duration_ms=args.nb_min_duration)
+    windows = None
+    if args.window:
+        windows = window_options(window_s=args.window,
+                                 step_s=args.window_step or args.window,
+                                 assign=args.window_assign)
+    return dict(stream_spikes=args.stream_spikes, chunksize=args.chunksize,
+                cache_dir=None if args.no_cache else args.cache_dir,
+                cache_size=int(args.cache_size * 1024 ** 3),
+                output_modes=args.output, store_dir=args.store,
+                spike_trains=spike_trains, burst_detection=burst_detection,
+                windows=windows, date=args.date,
+                profile=('memory' if args.profile_memory
+                         else 'time' if args.profile else None))
+
+
+def run_from_args(args):
+    from core.mea_pipeline import get_plate_files, run_plate
+    files = get_plate_files(args.base_dir, args.conditions_file,
+                            args.spikes_file, args.bursts_file,
+                            args.net_bursts_file,
+                            need_bursts=not args.detect_bursts)
+    run_plate(files, args.mins_recorded, **run_options(args))
+
+
+def batch_from_args(args):
+    from core import mea_batch
+    plates = mea_batch.discover_plates(
+            args.base_dir, args.conditions_file,
+            spikes_suffix=args.spikes_suffix,
+            bursts_suffix=args.bursts_suffix,
+            net_bursts_suffix=args.net_bursts_suffix,
+            need_bursts=not args.detect_bursts)
+    print(f'Found {len(plates)} plates in {args.base_dir}')
+    results = mea_batch.run_batch(plates, args.mins_recorded,
+                                  workers=args.workers, force=args.force,
+                                  **run_options(args))
+    print(mea_batch.summarize(results))
+    if any(r.status == 'failed' for r in results):
+        sys.exit(1)
+
+
+def sweep_from_args(args):
+    from core import mea_sweep
+    from core.mea_pipeline import get_plate_files
+    files = get_plate_files(args.base_dir, args.conditions_file,
+                            args.spikes_file, args.bursts_file,
+                            args.net_bursts_file,
+                            need_bursts=not args.detect_bursts)
+    options = run_options(args)
+    variants = mea_sweep.make_variants(
+            mea_sweep.read_sweep_grid(args.grid), files, args.mins_recorded,
+            spike_trains=options.pop('spike_trains'),
+            burst_detection=options.pop('burst_detection'),
+            windows=options.pop('windows'))
+    print(f'Running {len(variants)} variants of {files.plate_name}')
+    results = mea_sweep.run_sweep(files, variants, workers=args.workers,
+                                  out_dir=args.sweep_dir, **options)
+    if any(r.status == 'failed' for r in results):
+        sys.exit(1)
+
+
+def watch_from_args(args):
+    from core import mea_watch
+    mea_watch.watch(args.base_dir, args.mins_recorded,
+                    conditions_fname=args.conditions_file,
+                    spikes_suffix=args.spikes_suffix,
+                    bursts_suffix=args.bursts_suffix,
+                    net_bursts_suffix=args.net_bursts_suffix,
+                    workers=args.workers, interval=args.interval,
+                    settle=args.settle, state_file=args.state_file,
+                    once=args.once, use_events=not args.no_events,
+                    **run_options(args))
+
+
+def query_from_args(args):
+    from core import mea_store
+    data = mea_store.query(args.store_dir, plates=args.plate,
+                           conditions=args.condition, wells=args.well,
+                           metrics=args.metric, since=args.since,
+                           until=args.until)
+    if args.pivot:
+        data = mea_store.pivot(data, index=args.pivot[0],
+                               columns=args.pivot[1], aggfunc=args.aggfunc)
+    if args.out:
+        if args.out.endswith('.parquet'):
+            data.to_parquet(args.out)
+        elif args.out.endswith('.xlsx'):
+            data.to_excel(args.out)
+        else:
+            data.to_csv(args.out)
+        print(f'{len(data)} rows written to {args.out}')
+    else:
+        print(data.to_string())
+
+
+def gui_from_args(args):
+    # Gooey (and wxPython) only for the GUI
+    import spikes_burst_networkburst
+    spikes_burst_networkburst.main()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+            prog="mea_cli",
+            description=("Headless command line interface of the multiwell "
+                         "MEA analysis."),
+            formatter_class=help_formatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser(
+            'run',
+            help="analyze a single plate",
+            epilog=('example usage:\n\t'
+                    'python3 mea_cli.py run /mnt/data/multiwell/csv/ '
+                    'conditions_test.txt 5 spikes_test.csv bursts_test.csv '
+                    'net_bursts_test.csv\n\n' + CONDITIONS_EXAMPLE),
+            formatter_class=help_formatter)
+    add_plate_arguments(run_parser)
+    add_load_arguments(run_parser)
+    add_analysis_arguments(run_parser)
+    add_output_arguments(run_parser)
+    run_parser.set_defaults(func=run_from_args)
+
+    batch_parser = commands.add_parser(
+            'batch',
+            help="analyze all plates found below a directory in parallel",
+            description=("Finds every '<plate>_<spikes suffix>' file below "
+                         "base_dir that has matching bursts, network bursts "
+                         "and conditions files next to it and analyzes the "
+                         "plates in a process pool. Results are written to "
+                         "<dir>/<plate>/ like for a single plate."),
+            formatter_class=help_formatter)
+    batch_parser.add_argument("base_dir",
+                              type=str,
+                              help="directory that is searched recursively")
+    batch_parser.add_argument("mins_recorded",
+                              type=int,
+                              help="minutes recorded, e.g. 5")
+    add_discovery_arguments(batch_parser)
+    batch_parser.add_argument("--workers", "-j",
+                              type=int,
+                              default=None,
+                              help=("number of worker processes (default: "
+                                    "number of CPUs)"))
+    batch_parser.add_argument("--force",
+                              action='store_true',
+                              help="also analyze plates with up to date outputs")
+    add_load_arguments(batch_parser)
+    add_analysis_arguments(batch_parser)
+    add_output_arguments(batch_parser)
+    batch_parser.set_defaults(func=batch_from_args)
+
+    sweep_parser = commands.add_parser(
+            'sweep',
+            help="analyze a plate with many parameter sets",
+            description=("Parses the files of one plate once and analyzes "
+                         "it with every parameter set of a grid file in "
+                         "parallel. The results of each variant are written "
+                         "to <plate output>/sweep/<label>/, the run times to "
+                         "sweep_summary.csv next to them. The grid file "
+                         "holds a python dict of parameter -> list of "
+                         "values (all combinations are run) or a list of "
+                         "parameter dicts. Parameters are mins_recorded, "
+                         "conditions_file, label and the burst detection "
+                         "(e.g. max_isi_end_ms, nb_min_channels) and spike "
+                         "train (e.g. rate_bin_s) options. Parameters not "
+                         "in the grid are taken from the arguments."),
+            epilog=('example grid file:\n\n'
+                    '{\n'
+                    '\t\'mins_recorded\': [5, 10],\n'
+                    '\t\'max_isi_end_ms\': [50, 100, 200]\n'
+                    '}\n\n' + CONDITIONS_EXAMPLE),
+            formatter_class=help_formatter)
+    add_plate_arguments(sweep_parser)
+    sweep_parser.add_argument("--grid",
+                              type=str,
+                              required=True,
+                              help="grid file with the parameter sets")
+    sweep_parser.add_argument("--workers", "-j",
+                              type=int,
+                              default=None,
+                              help=("number of worker processes (default: "
+                                    "number of CPUs)"))
+    sweep_parser.add_argument("--sweep-dir",
+                              type=str,
+                              default=None,
+                              help=("output directory of the variants "
+                                    "(default: <plate output>/sweep)"))
+    add_load_arguments(sweep_parser)
+    add_analysis_arguments(sweep_parser)
+    add_output_arguments(sweep_parser)
+    sweep_parser.set_defaults(func=sweep_from_args)
+
+    watch_parser = commands.add_parser(
+            'watch',
+            help="analyze new plates as they are exported into a directory",
+            description=("Watches base_dir (recursively) for plates like "
+                         "batch does and analyzes every plate whose files "
+                         "have stopped changing, with at most --workers "
+                         "plates at a time. Files are only checked with "
+                         "stat (and file system events if the watchdog "
+                         "package is installed), never read before the "
+                         "analysis. Processed plates are remembered in a "
+                         "state file and analyzed again only if their "
+                         "files change, also across restarts."),
+            epilog=('example usage:\n\t'
+                    'python3 mea_cli.py watch /mnt/rig-exports 5 -j 2 '
+                    '--output workbook'),
+            formatter_class=help_formatter)
+    watch_parser.add_argument("base_dir",
+                              type=str,
+                              help="directory that is watched recursively")
+    watch_parser.add_argument("mins_recorded",
+                              type=int,
+                              help="minutes recorded, e.g. 5")
+    add_discovery_arguments(watch_parser)
+    watch_parser.add_argument("--workers", "-j",
+                              type=int,
+                              default=None,
+                              help=("plates analyzed at the same time "
+                                    "(default: number of CPUs)"))
+    watch_parser.add_argument("--interval",
+                              type=float,
+                              default=10.,
+                              help="seconds between scans of base_dir")
+    watch_parser.add_argument("--settle",
+                              type=float,
+                              default=30.,
+                              help=("seconds the files of a plate must be "
+                                    "unchanged before it is analyzed"))
+    watch_parser.add_argument("--state-file",
+                              type=str,
+                              default=None,
+                              help=("file the processed plates are kept in "
+                                    "(default: base_dir/.mea_watch_state.json)"))
+    watch_parser.add_argument("--once",
+                              action='store_true',
+                              help=("exit when all plates found are analyzed "
+                                    "instead of watching until Ctrl+C"))
+    watch_parser.add_argument("--no-events",
+                              action='store_true',
+                              help=("only scan every --interval seconds, "
+                                    "even if watchdog is installed"))
+    add_load_arguments(watch_parser)
+    add_analysis_arguments(watch_parser)
+    add_output_arguments(watch_parser)
+    watch_parser.set_defaults(func=watch_from_args)
+
+    query_parser = commands.add_parser(
+            'query',
+            help="query the metrics store filled with --store",
+            description=("Prints (or writes) the rows of a metrics store "
+                         "that match all given filters, optionally pivoted. "
+                         "Store columns are plate, base, date, condition, "
+                         "well, channel, metric and value."),
+            epilog=('example usage:\n\t'
+                    'python3 mea_cli.py query /mnt/data/store --metric '
+                    'spike_counts_per_min --since 2021-06-01 '
+                    '--pivot condition plate'),
+            formatter_class=help_formatter)
+    query_parser.add_argument("store_dir",
+                              type=str,
+                              help="directory of the metrics store")
+    query_parser.add_argument("--plate", nargs='+', help="plate name(s)")
+    query_parser.add_argument("--condition", nargs='+',
+                              help="cell line(s)/condition(s)")
+    query_parser.add_argument("--well", nargs='+', help="well(s), e.g. A1")
+    query_parser.add_argument("--metric", nargs='+',
+                              help=("metric(s), i.e. output table names, e.g. "
+                                    "spike_counts_per_min"))
+    query_parser.add_argument("--since",
+                              help="first recording date, e.g. 2021-06-01")
+    query_parser.add_argument("--until",
+                              help="last recording date, e.g. 2021-06-30")
+    query_parser.add_argument("--pivot",
+                              nargs=2,
+                              metavar=('INDEX', 'COLUMNS'),
+                              help=("pivot the values, e.g. condition metric"))
+    query_parser.add_argument("--aggfunc",
+                              default='mean',
+                              help="aggregation of pivoted values")
+    query_parser.add_argument("--out",
+                              help="write to a .csv, .xlsx or .parquet file")
+    query_parser.set_defaults(func=query_from_args)
+
+    gui_parser = commands.add_parser(
+            'gui',
+            help="open the Gooey form of a single plate run",
+            description=("Needs the gooey package. The other commands "
+                         "never import it and run without a display."))
+    gui_parser.set_defaults(func=gui_from_args)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
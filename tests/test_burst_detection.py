@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.mea_burst_detection import (burst_detection_options, detect_all,
+                                      detect_bursts, detect_network_bursts)
+from core.mea_spike_trains import TIMESTAMP_COL, spike_trains
+
+WELLS = ['A1', 'A2', 'B1']
+CHANNELS = ['12', '21', '34', '43']
+
+
+def reference_bursts(times, o: burst_detection_options):
+    """Max interval method on the sorted times of one channel, in a loop."""
+    found = []
+    i = 0
+    while i < len(times) - 1:
+        isi = times[i + 1] - times[i]
+        if isi <= o.max_isi_start_ms * 1e3 and isi <= o.max_isi_end_ms * 1e3:
+            j = i + 1
+            while (j < len(times) - 1
+                   and times[j + 1] - times[j] <= o.max_isi_end_ms * 1e3):
+                j += 1
+            found.append([i, j])
+            i = j + 1
+        else:
+            i += 1
+    merged = []
+    for first, last in found:
+        if merged and times[first] - times[merged[-1][1]] < o.min_ibi_ms * 1e3:
+            merged[-1][1] = last
+        else:
+            merged.append([first, last])
+    return [(times[first], times[last] - times[first], last - first + 1)
+            for first, last in merged
+            if (times[last] - times[first] >= o.min_duration_ms * 1e3
+                and last - first + 1 >= o.min_spike_count)]
+
+
+def reference_network_bursts(spikes, bursts, o: burst_detection_options):
+    """Sweep over the bursts of one well at a time, in a loop."""
+    found = []
+    for well in bursts['Well Label'].cat.categories:
+        well_bursts = bursts[bursts['Well Label'] == well]
+        events = sorted([(s, 1) for s in well_bursts['Start timestamp [µs]']]
+                        + [(s + d, -1) for s, d in zip(
+                                well_bursts['Start timestamp [µs]'],
+                                well_bursts['Duration [µs]'])],
+                        key=lambda e: (e[0], e[1]))
+        intervals = []
+        active = 0
+        for time, delta in events:
+            before, active = active, active + delta
+            if before < o.nb_min_channels <= active:
+                start = time
+            elif active < o.nb_min_channels <= before:
+                intervals.append([start, time])
+        merged = []
+        for start, end in intervals:
+            if merged and start - merged[-1][1] < o.nb_min_ibi_ms * 1e3:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        times = spikes.loc[spikes['Well Label'] == well, TIMESTAMP_COL]
+        for start, end in merged:
+            if end - start >= o.nb_min_duration_ms * 1e3:
+                count = int(((times >= start) & (times <= end)).sum())
+                found.append((well, start, end - start, count))
+    return found
+
+
+def synthetic_spikes(rng, wells=WELLS, channels=CHANNELS, seconds=20):
+    # Sparse background plus bursts shared by the channels of a well, some
+    # of them close enough to be merged
+    rows = []
+    for well in wells:
+        burst_starts = np.sort(rng.uniform(0, seconds * 1e6, 8))
+        burst_starts = np.r_[burst_starts, burst_starts[:2] + 120_000]
+        for channel in channels:
+            times = [rng.uniform(0, seconds * 1e6, 20)]
+            for start in burst_starts:
+                if rng.random() < 0.8:
+                    count = rng.integers(2, 12)
+                    times.append(start + rng.uniform(0, 20_000)
+                                 + np.cumsum(rng.exponential(8_000, count)))
+            times = np.unique(np.concatenate(times).astype(np.int64))
+            rows.append(pd.DataFrame({'Well Label': well,
+                                      'Channel Label': channel,
+                                      TIMESTAMP_COL: times}))
+    spikes = pd.concat(rows, ignore_index=True)
+    for col in ['Well Label', 'Channel Label']:
+        spikes[col] = spikes[col].astype('category')
+    return spikes
+
+
+def bursts_by_channel(bursts):
+    return sorted(zip(bursts['Well Label'].astype(str),
+                      bursts['Channel Label'].astype(str),
+                      bursts['Start timestamp [µs]'],
+                      bursts['Duration [µs]'], bursts['Spike Count']))
+
+
+OPTIONS = [burst_detection_options(),
+           burst_detection_options(max_isi_start_ms=10., max_isi_end_ms=30.,
+                                   min_ibi_ms=200., min_spike_count=3,
+                                   nb_min_channels=2),
+           burst_detection_options(min_ibi_ms=0., min_duration_ms=0.,
+                                   min_spike_count=2, nb_min_ibi_ms=0.,
+                                   nb_min_duration_ms=0., nb_min_channels=1)]
+
+
+@pytest.mark.parametrize('options', OPTIONS)
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_reference(seed, options):
+    spikes = synthetic_spikes(np.random.default_rng(seed))
+    trains = spike_trains(spikes)
+    bursts = detect_bursts(trains, options)
+
+    expected = []
+    for (well, channel), group in spikes.groupby(
+            ['Well Label', 'Channel Label'], observed=True):
+        times = np.sort(group[TIMESTAMP_COL].to_numpy())
+        expected += [(well, channel, *burst)
+                     for burst in reference_bursts(times, options)]
+    assert bursts_by_channel(bursts) == sorted(expected)
+    assert len(bursts) > 0
+
+    net_bursts = detect_network_bursts(trains, bursts, options)
+    assert sorted(zip(net_bursts['Well Label'].astype(str),
+                      net_bursts['Start timestamp [µs]'],
+                      net_bursts['Duration [µs]'],
+                      net_bursts['Spike Count'])) == sorted(
+            reference_network_bursts(spikes, bursts, options))
+
+
+def test_merged_bursts():
+    # Two bursts 60 ms apart are merged (min_ibi_ms 100), the spikes between
+    # them count as well
+    first = np.arange(0, 60_000, 10_000)
+    second = first[-1] + 60_000 + np.arange(0, 60_000, 10_000)
+    lonely = [second[-1] + 1_000_000]
+    spikes = pd.DataFrame({'Well Label': pd.Categorical(['A1'] * 13),
+                           'Channel Label': pd.Categorical(['12'] * 13),
+                           TIMESTAMP_COL: np.r_[first, second, lonely]})
+    bursts = detect_bursts(spike_trains(spikes))
+    assert len(bursts) == 1
+    assert bursts['Start timestamp [µs]'].iloc[0] == 0
+    assert bursts['Duration [µs]'].iloc[0] == second[-1]
+    assert bursts['Spike Count'].iloc[0] == 12
+
+
+def test_single_channel():
+    spikes = synthetic_spikes(np.random.default_rng(0), wells=['A1'],
+                              channels=['12'])
+    options = burst_detection_options(nb_min_channels=1)
+    bursts, net_bursts = detect_all(spikes, options)
+    times = spikes[TIMESTAMP_COL].to_numpy()
+    assert bursts_by_channel(bursts) == [
+            ('A1', '12', *burst) for burst in reference_bursts(times,
+                                                                options)]
+    # With one electrode every burst is a network burst
+    assert (net_bursts['Start timestamp [µs]'].tolist()
+            == bursts['Start timestamp [µs]'].tolist())
+
+
+def test_empty():
+    spikes = pd.DataFrame({'Well Label': pd.Categorical([]),
+                           'Channel Label': pd.Categorical([]),
+                           TIMESTAMP_COL: np.zeros(0, dtype=np.int64)})
+    bursts, net_bursts = detect_all(spikes)
+    assert len(bursts) == 0 and len(net_bursts) == 0
+    assert 'Start timestamp [µs]' in bursts
+    assert 'Start timestamp [µs]' in net_bursts
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from benchmarks.generate_mcs import plate_spec, well_labels, write_plate
+from core.mea_analysis import (analyze, condition_map, get_condition_labels,
+                               read_conditions)
+from core.mea_io import load_mcs_csv
+from core.mea_options import spike_train_options, window_options
+
+
+def test_condition_map():
+    assert condition_map({'K2': ['A1', 'B1'], 'P7': ['A2']}) == {
+            'A1': 'K2_A1', 'B1': 'K2_B1', 'A2': 'P7_A2'}
+
+
+@pytest.mark.parametrize('conditions', [
+        {'K2': ['A1', 'B1'], 'P7': ['A2', 'B1']},
+        {'K2': ['A1', 'B1', 'A1']}])
+def test_well_listed_twice(conditions, tmp_path):
+    with pytest.raises(ValueError, match='B1|A1'):
+        condition_map(conditions)
+    conditions_file = os.path.join(tmp_path, 'conditions.txt')
+    with open(conditions_file, 'w') as f:
+        f.write(repr(conditions))
+    with pytest.raises(ValueError):
+        read_conditions(conditions_file)
+
+
+def test_unassigned_wells_left_out(tmp_path):
+    out_dir = str(tmp_path)
+    write_plate(out_dir, plate_spec(wells=6, channels=4, duration_s=60),
+                'plate')
+    wells = well_labels(6)
+    # Wells out of plate order, two wells in no condition
+    conditions = {'treated': [wells[3], wells[0]], 'control': [wells[5],
+                                                               wells[2]]}
+    unassigned = {wells[1], wells[4]}
+    tables = analyze(
+            load_mcs_csv(os.path.join(out_dir, 'plate_spikes.csv'),
+                         'spikes', extra_columns={'Timestamp [µs]': 'int64'}),
+            load_mcs_csv(os.path.join(out_dir, 'plate_bursts.csv'), 'bursts'),
+            load_mcs_csv(os.path.join(out_dir, 'plate_net_bursts.csv'),
+                         'net_bursts'),
+            conditions, 1, spike_trains=spike_train_options(),
+            windows=window_options(window_s=30., step_s=30.))
+
+    condition_labels = get_condition_labels(conditions)
+    for name, table in tables.items():
+        if name == 'windowed_metrics':
+            assert set(table['well']) == set(wells) - unassigned
+            assert not table['condition'].isna().any()
+        elif table.ndim == 1:
+            assert list(table.index) == condition_labels, name
+        else:
+            assert list(table.columns) == condition_labels, name
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.mea_analysis import inter_burst_intervals
+
+IBI_COL = 'inter burst interval [µs]'
+
+
+def loop_inter_burst_intervals(arr, group_col):
+    """The original .loc loop of spikes_burst_networkburst.py."""
+    arr = arr.copy()
+    for i in range(1, arr.shape[0]):
+        if arr.loc[i, group_col] == arr.loc[(i-1), group_col]:
+            start_t = arr.loc[i, "Start timestamp [µs]"]
+            end_t = arr.loc[(i-1), 'End timestamp [µs]']
+            arr.loc[i, IBI_COL] = start_t - end_t
+
+    if arr.shape[0] < 2:
+        arr[IBI_COL] = np.nan
+    # The loop never creates the column if no two neighbours match
+    if IBI_COL not in arr:
+        arr[IBI_COL] = np.nan
+    return arr[IBI_COL].astype('float64')
+
+
+def random_bursts(rng, rows, labels, categorical):
+    # Labels interleaved at random, so runs of one label are short
+    label = rng.choice(labels, rows)
+    start = np.cumsum(rng.integers(1, 100_000, rows))
+    bursts = pd.DataFrame({
+            'Channel Label': label,
+            'Start timestamp [µs]': start,
+            'End timestamp [µs]': start + rng.integers(0, 50_000, rows)})
+    if categorical:
+        bursts['Channel Label'] = bursts['Channel Label'].astype('category')
+    return bursts
+
+
+@pytest.mark.parametrize('categorical', [False, True])
+@pytest.mark.parametrize('rows', [0, 1, 2, 5, 50, 500])
+def test_matches_loop(rows, categorical):
+    rng = np.random.default_rng(rows)
+    for labels in [['A1'], ['A1', 'B2'], ['A1', 'B2', 'C3', 'D4', 'D5']]:
+        bursts = random_bursts(rng, rows, labels, categorical)
+        expected = loop_inter_burst_intervals(bursts, 'Channel Label')
+        result = inter_burst_intervals(bursts, 'Channel Label')
+        pd.testing.assert_series_equal(result, expected, check_names=False)
@@ -0,0 +1,29 @@
+import datetime
+import os
+
+import pytest
+
+from core.mea_store import recording_date
+
+
+@pytest.mark.parametrize('name', ['2021-06-14_plate1_spikes.csv',
+                                  'plate1_2021_06_14_spikes.csv',
+                                  'P3_20210614_spikes.csv',
+                                  'P3_20211399_20210614_spikes.csv'])
+def test_date_from_name(name):
+    assert recording_date(name) == datetime.datetime(2021, 6, 14)
+
+
+def test_given_date_wins():
+    assert (recording_date('2020-01-01_plate1_spikes.csv', '2021-06-14')
+            == datetime.datetime(2021, 6, 14))
+
+
+def test_modification_time(tmp_path):
+    # No date in the name, e.g. an ID that is no valid date
+    spikes_file = os.path.join(tmp_path, '21517050_spikes.csv')
+    open(spikes_file, 'w').close()
+    mtime = datetime.datetime(2021, 6, 14, 12, 30).timestamp()
+    os.utime(spikes_file, (mtime, mtime))
+    assert recording_date(spikes_file) == datetime.datetime(2021, 6, 14, 12,
+                                                            30)
@@ -0,0 +1,45 @@
+import os
+
+import pandas as pd
+import pytest
+
+from benchmarks.generate_mcs import plate_spec, write_plate
+from core.mea_analysis import analyze, read_conditions
+from core.mea_io import count_spikes_chunked, load_mcs_csv
+
+
+@pytest.fixture(scope='module')
+def plate(tmp_path_factory):
+    out_dir = str(tmp_path_factory.mktemp('plate'))
+    write_plate(out_dir, plate_spec(wells=6, channels=4, duration_s=60),
+                'plate')
+    return out_dir
+
+
+def _analyze(plate, spikes):
+    return analyze(spikes,
+                   load_mcs_csv(os.path.join(plate, 'plate_bursts.csv'),
+                                'bursts'),
+                   load_mcs_csv(os.path.join(plate, 'plate_net_bursts.csv'),
+                                'net_bursts'),
+                   read_conditions(os.path.join(plate, 'conditions.txt')), 1)
+
+
+@pytest.mark.parametrize('chunksize', [100, 1_000, 10 ** 7])
+def test_streamed_counts_equal_loaded(plate, chunksize):
+    spikes_file = os.path.join(plate, 'plate_spikes.csv')
+    loaded = _analyze(plate, load_mcs_csv(spikes_file, 'spikes'))
+    streamed = _analyze(plate, count_spikes_chunked(spikes_file, chunksize))
+
+    for name in ['spike_counts', 'spike_counts_per_min',
+                 'spont_spike_counts', 'spont_spike_ratio']:
+        pd.testing.assert_frame_equal(streamed[name], loaded[name],
+                                      obj=name)
+    # The spikes are only used for the counts, the rest is equal as well
+    assert list(streamed) == list(loaded)
+    for name in loaded:
+        if loaded[name].ndim == 1:
+            pd.testing.assert_series_equal(streamed[name], loaded[name])
+        else:
+            pd.testing.assert_frame_equal(streamed[name], loaded[name],
+                                          obj=name)
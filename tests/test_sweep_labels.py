@@ -0,0 +1,45 @@
+import os
+
+from core.mea_pipeline import plate_files
+from core.mea_sweep import _label, make_variants
+
+
+def test_float_values():
+    assert _label({'rate_bin_s': 0.5}) == 'rate_bin_s=0.5'
+    assert _label({'rate_bin_s': 0.75}) == 'rate_bin_s=0.75'
+    assert _label({'max_isi_end_ms': 50.0}) == 'max_isi_end_ms=50'
+    assert _label({'mins_recorded': 5}) == 'mins_recorded=5'
+
+
+def test_conditions_file():
+    assert (_label({'conditions_file': 'conditions_b.txt',
+                    'min_ibi_ms': 200.5})
+            == 'conditions_file=conditions_b,min_ibi_ms=200.5')
+    assert _label({}) == 'default'
+
+
+def _plate(tmp_path):
+    with open(os.path.join(tmp_path, 'conditions.txt'), 'w') as f:
+        f.write("{'control': ['A1', 'A2'], 'treated': ['B1']}")
+    return plate_files(str(tmp_path), 'plate',
+                       os.path.join(tmp_path, 'conditions.txt'),
+                       os.path.join(tmp_path, 'plate_spikes.csv'),
+                       os.path.join(tmp_path, 'plate_bursts.csv'),
+                       os.path.join(tmp_path, 'plate_net_bursts.csv'))
+
+
+def test_float_grid_labels(tmp_path):
+    variants = make_variants([{'rate_bin_s': 0.5}, {'rate_bin_s': 0.75}],
+                             _plate(tmp_path), 5)
+    assert [v.label for v in variants] == ['rate_bin_s=0.5',
+                                           'rate_bin_s=0.75']
+    assert [v.spike_trains.rate_bin_s for v in variants] == [0.5, 0.75]
+
+
+def test_colliding_labels(tmp_path):
+    variants = make_variants([{'label': 'a'}, {'label': 'a'},
+                              {'rate_bin_s': 1.0}, {'rate_bin_s': 1}],
+                             _plate(tmp_path), 5)
+    labels = [v.label for v in variants]
+    assert labels == ['a', 'a_1', 'rate_bin_s=1', 'rate_bin_s=1_3']
+    assert len(set(labels)) == len(labels)